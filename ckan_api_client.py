@@ -2,14 +2,27 @@
 Ckan API client
 """
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+import codecs
+import concurrent.futures
 import copy
+import errno
 import functools
+import hashlib
+import importlib
+import itertools
 import json
+import os
+import random
+import re
+import threading
+import time
 import urlparse
 import warnings
+import zlib
 
 import requests
+import requests.adapters
 
 
 DATASET_FIELDS = {
@@ -81,6 +94,20 @@ class HTTPError(Exception):
         return "HTTPError [{0}]: {1}".format(self.status_code, self.message)
 
 
+class FetchError(Exception):
+    """
+    Exception raised when fetching an object fails during
+    a concurrent iteration.
+    """
+
+    def __init__(self, object_id, error):
+        self.object_id = object_id
+        self.error = error
+
+    def __str__(self):
+        return "FetchError [{0}]: {1}".format(self.object_id, self.error)
+
+
 class BadApiError(Exception):
     """Exception used to mark bad behavior from the API"""
     pass
@@ -95,8 +122,14 @@ class SomethingWentWrong(Exception):
     """
     Exception to indicate that something went wrong during
     a data import.. :(
+
+    The (partial) result of the import, if any, is available
+    as the ``result`` attribute.
     """
-    pass
+
+    def __init__(self, message, result=None):
+        super(SomethingWentWrong, self).__init__(message)
+        self.result = result
 
 
 ##----------------------------------------------------------------------
@@ -109,48 +142,107 @@ class SomethingWentWrong(Exception):
 ##----------------------------------------------------------------------
 
 
+## Validation mode, from the CKAN_API_CLIENT_VALIDATION environment
+## variable. Since it is applied when decorating functions, it needs
+## to be set before this module is imported.
+##
+## - strict: validate arguments / return values of all calls (default)
+## - sample: only validate one call every VALIDATION_SAMPLE_RATE,
+##   from the CKAN_API_CLIENT_VALIDATION_SAMPLE variable (default 100)
+## - off: production mode, functions are not wrapped at all
+
+VALIDATION_MODE = os.environ.get('CKAN_API_CLIENT_VALIDATION', 'strict')
+VALIDATION_SAMPLE_RATE = int(
+    os.environ.get('CKAN_API_CLIENT_VALIDATION_SAMPLE', 100))
+
+if VALIDATION_MODE not in ('strict', 'sample', 'off'):
+    raise ValueError("Invalid validation mode: {0!r}"
+                     .format(VALIDATION_MODE))
+
+
 def validate(validator, value):
+    return compile_validator(validator)(value)
+
+
+def compile_validator(validator):
+    """
+    Turn a validator (None, a type or a callable) into a function
+    returning whether a value is valid.
+    """
     if validator is None:
-        return True
+        return lambda value: True
     if isinstance(validator, type):
-        return isinstance(value, validator)
+        return lambda value: isinstance(value, validator)
     if callable(validator):
-        return validator(value)
+        return validator
     raise TypeError("Invalid validator type: {0}".format(type(validator)))
 
 
-def check_arg_types(*a_types, **kw_types):
-    def decorator(func):
-        @functools.wraps(func)
-        def wrapped(*a, **kw):
-            # Validate arguments
-            for validator, value in zip(a_types, a):
-                if not validate(validator, value):
-                    raise TypeError("Invalid argument type")
-
-            # Validate keyword arguments
-            for key, validator in kw_types.iteritems():
-                if key not in kw:
-                    continue
-                value = kw[key]
-                if not validate(validator, value):
-                    raise TypeError("Invalid argument type")
+def _checked(func, a_types=(), kw_types=None, retval=None):
+    """
+    Wrap a function in order to validate arguments / return value.
+
+    Validators are compiled only once, here. If ``func`` has already
+    been wrapped by this function (ie. decorators are stacked), its
+    validators are merged with the new ones, so that only one
+    wrapper is used.
+    """
 
-            # Actually call the function
+    if VALIDATION_MODE == 'off':
+        return func
+
+    kw_types = dict(kw_types or {})
+    if hasattr(func, '_validation'):
+        func, _a_types, _kw_types, _retval = func._validation
+        a_types = a_types or _a_types
+        kw_types = dict(_kw_types, **kw_types)
+        retval = retval if retval is not None else _retval
+
+    a_checks = [(i, compile_validator(v))
+                for i, v in enumerate(a_types) if v is not None]
+    kw_checks = [(k, compile_validator(v))
+                 for k, v in kw_types.iteritems() if v is not None]
+    retval_check = (compile_validator(retval)
+                    if retval is not None else None)
+    sample_counter = (itertools.count()
+                      if VALIDATION_MODE == 'sample' else None)
+
+    @functools.wraps(func)
+    def wrapped(*a, **kw):
+        if sample_counter is not None \
+                and next(sample_counter) % VALIDATION_SAMPLE_RATE:
             return func(*a, **kw)
-        return wrapped
+
+        # Validate arguments
+        for i, check in a_checks:
+            if i < len(a) and not check(a[i]):
+                raise TypeError("Invalid argument type")
+
+        # Validate keyword arguments
+        for key, check in kw_checks:
+            if key in kw and not check(kw[key]):
+                raise TypeError("Invalid argument type")
+
+        # Actually call the function
+        value = func(*a, **kw)
+
+        if retval_check is not None and not retval_check(value):
+            raise TypeError("Invalid return value")
+        return value
+
+    wrapped._validation = (func, a_types, kw_types, retval)
+    return wrapped
+
+
+def check_arg_types(*a_types, **kw_types):
+    def decorator(func):
+        return _checked(func, a_types=a_types, kw_types=kw_types)
     return decorator
 
 
 def check_retval(checker):
     def decorator(func):
-        @functools.wraps(func)
-        def wrapped(*a, **kw):
-            retval = func(*a, **kw)
-            if not validate(checker, retval):
-                raise TypeError("Invalid return value")
-            return retval
-        return wrapped
+        return _checked(func, retval=checker)
     return decorator
 
 
@@ -167,13 +259,20 @@ def is_list_of(type_):
 
 
 def is_dict_of(key_type, value_type):
+    check_key = compile_validator(key_type)
+    check_value = compile_validator(value_type)
+
     def inner(obj):
         if not isinstance(obj, dict):
             raise TypeError("Object is not a dict")
 
         for key, value in obj.iteritems():
-            validate(key_type, key)
-            validate(value_type, value)
+            if not check_key(key):
+                raise TypeError("A key in the dict is not a {0!r}"
+                                .format(key_type))
+            if not check_value(value):
+                raise TypeError("A value in the dict is not a {0!r}"
+                                .format(value_type))
 
         return True
     return inner
@@ -210,21 +309,674 @@ def validate_dataset(dataset):
     return True  # Validation passed
 
 
+def normalize_dataset(dataset):
+    """
+    Convert a dataset as returned by API v3 (eg. by ``package_search``)
+    to the same format returned by API v2 ``GET /rest/dataset/<id>``.
+
+    - extras: list of {'key': .., 'value': ..} -> dict
+    - groups: list of objects -> list of ids
+    - tags: list of objects -> list of names
+    """
+    dataset = dict(dataset)
+
+    if isinstance(dataset.get('extras'), list):
+        dataset['extras'] = dict(
+            (x['key'], x['value']) for x in dataset['extras'])
+
+    if 'groups' in dataset:
+        dataset['groups'] = [
+            x['id'] if isinstance(x, dict) else x
+            for x in dataset['groups']]
+
+    if 'tags' in dataset:
+        dataset['tags'] = [
+            x['name'] if isinstance(x, dict) else x
+            for x in dataset['tags']]
+
+    ## API v3 splits relationships in "as subject" / "as object",
+    ## and search results usually don't contain them at all.
+    dataset.setdefault('relationships', [])
+    dataset.pop('relationships_as_subject', None)
+    dataset.pop('relationships_as_object', None)
+
+    return dataset
+
+
+def canonical_json(obj):
+    """
+    Serialize an object to "canonical" JSON: sorted keys, no whitespace,
+    non-ASCII characters escaped.
+
+    This always uses the standard library ``json`` module, whatever
+    codec is used by clients, so the output is stable (eg. for
+    fingerprints) regardless of the installed libraries.
+    """
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
+def dataset_fingerprint(dataset, exclude_extra=None):
+    """
+    Calculate a fingerprint of the content of a dataset.
+
+    The fingerprint is the SHA1 of the dataset serialized as "canonical"
+    JSON (sorted keys, no whitespace), so it doesn't depend on the order
+    of the keys in dicts.
+
+    :param exclude_extra:
+        name of an extra to be ignored, usually the one in which
+        the fingerprint itself is going to be stored.
+    """
+    if exclude_extra is not None and exclude_extra in (
+            dataset.get('extras') or {}):
+        dataset = dict(dataset)
+        dataset['extras'] = dict(dataset['extras'])
+        del dataset['extras'][exclude_extra]
+    return hashlib.sha1(canonical_json(dataset)).hexdigest()
+
+
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def _decode_chunks(chunks, encoding):
+    """Incrementally decode byte strings to unicode"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        if not isinstance(chunk, unicode):
+            chunk = decoder.decode(chunk)
+        yield chunk
+    yield decoder.decode('', final=True)
+
+
+def iter_json_list(chunks, encoding='utf-8'):
+    """
+    Incrementally decode a JSON list, yielding its items as soon
+    as they are available.
+
+    Only the current chunk (plus any incomplete item) is kept in
+    memory, so huge lists can be processed in constant memory.
+
+    :param chunks: iterable of (byte) strings, eg. the response body
+    :param encoding: used to decode byte strings
+    """
+    decoder = json.JSONDecoder()
+    chunks = _decode_chunks(chunks, encoding)
+    buf, pos = u'', 0
+    need_more, exhausted = False, False
+    state = 'start'  # start -> first -> (item -> sep)* -> end
+
+    while True:
+        pos = _JSON_WHITESPACE.match(buf, pos).end()
+
+        if (pos == len(buf) or need_more) and not exhausted:
+            chunk = next(chunks, None)
+            if chunk is not None:
+                buf, pos = buf[pos:] + chunk, 0
+                need_more = False
+                continue
+            exhausted = True
+
+        if pos == len(buf):
+            raise ValueError("Unexpected end of JSON list")
+
+        if state == 'start':
+            if buf[pos] != u'[':
+                raise ValueError("Expected a JSON list")
+            pos += 1
+            state = 'first'
+
+        elif state == 'sep':
+            if buf[pos] == u']':
+                return
+            if buf[pos] != u',':
+                raise ValueError("Expected ',' at position {0}".format(pos))
+            pos += 1
+            state = 'item'
+
+        elif state == 'first' and buf[pos] == u']':
+            return
+
+        else:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if exhausted:
+                    raise
+                need_more = True  # incomplete item
+                continue
+            if not exhausted and (end == len(buf)
+                                  or buf[end] not in u', \t\n\r]'):
+                need_more = True  # numbers might be truncated too
+                continue
+            pos = end
+            state = 'sep'
+            yield value
+
+
+def solr_date(value):
+    """
+    Convert a Ckan timestamp (eg. ``metadata_modified``) into
+    a date suitable for Solr queries (milliseconds precision, UTC).
+    """
+    if '.' in value:
+        base, fraction = value.split('.', 1)
+        value = '{0}.{1}'.format(base, fraction[:3])
+    return value.rstrip('Z') + 'Z'
+
+
+##----------------------------------------------------------------------
+## Transport helpers
+##----------------------------------------------------------------------
+
+
+## JSON libraries to try, fastest first
+JSON_BACKENDS = ('ujson', 'simplejson', 'json')
+
+
+class JsonCodec(object):
+    """
+    JSON encoder / decoder used by clients for request and
+    response bodies, using the fastest library available.
+
+    .. note::
+
+        Output of different backends is equivalent JSON, but not
+        necessarily identical (eg. escaping, key order): use
+        ``canonical_json()`` where exact output matters.
+    """
+
+    def __init__(self, backend=None):
+        """
+        :param backend:
+            name of the JSON library to use (or the module itself).
+            If omitted, the first one available from ``JSON_BACKENDS``
+            will be used.
+        """
+        if backend is None:
+            for name in JSON_BACKENDS:
+                try:
+                    backend = importlib.import_module(name)
+                except ImportError:
+                    continue
+                break
+        elif isinstance(backend, basestring):
+            backend = importlib.import_module(backend)
+        self.backend = backend
+        self.name = backend.__name__
+
+    def dumps(self, obj):
+        return self.backend.dumps(obj)
+
+    def loads(self, data):
+        return self.backend.loads(data)
+
+
+## Response status codes meaning the server is overloaded
+OVERLOAD_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class AdaptiveLimiter(object):
+    """
+    Limit the number of requests "in flight" at any given time,
+    adapting the limit to the server response, AIMD-style:
+
+    - on success, the limit is increased by ``increase / limit``,
+      that is: by ``increase`` for each "window" of requests;
+    - when the server looks overloaded (5xx / 429 responses,
+      connection errors, latency over ``latency_target``), the limit
+      is multiplied by ``decrease_factor``.
+
+    Only requests started after the last decrease can trigger another
+    one, so that a burst of failures only counts once.
+
+    A limiter can be shared by multiple clients (and threads).
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, increase=1.0,
+                 decrease_factor=0.5, latency_target=None):
+        """
+        :param initial: initial concurrency limit
+        :param minimum: the limit will never go below this
+        :param maximum: the limit will never go above this
+        :param increase: additive increase, per window of requests
+        :param decrease_factor: multiplicative decrease factor
+        :param latency_target:
+            if specified, requests taking longer than this
+            (in seconds) will be considered as a sign of overload
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.overloads = 0
+        self._generation = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait for a free slot.
+
+        :return: a token to be passed to ``release()``
+        """
+        with self._condition:
+            self.waiting += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    self._condition.wait()
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            return self._generation
+
+    def release(self, token, latency, overloaded=False):
+        """
+        Release a slot, adapting the limit to the request outcome.
+
+        :param token: as returned by ``acquire()``
+        :param latency: request duration, in seconds
+        :param overloaded: whether the server signaled overload
+        """
+        if self.latency_target is not None \
+                and latency > self.latency_target:
+            overloaded = True
+
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.overloads += 1
+                if token == self._generation:
+                    self._generation += 1
+                    self.limit = max(self.minimum,
+                                     self.limit * self.decrease_factor)
+            else:
+                self.limit = min(self.maximum,
+                                 self.limit + self.increase / self.limit)
+            self._condition.notify_all()
+
+    def stats(self):
+        """
+        :return: a dict with current ``limit``, number of requests
+            ``in_flight``, number of requests ``waiting`` for a slot
+            (queue depth) and total number of ``overloads`` detected.
+        """
+        with self._condition:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'overloads': self.overloads,
+            }
+
+
+class RetryPolicy(object):
+    """
+    Policy for retrying failed requests, with exponential backoff.
+
+    Requests are retried on connection errors, timeouts and responses
+    with one of ``retry_statuses``, but only for idempotent methods
+    (GET, HEAD, OPTIONS, PUT of full objects, DELETE), unless
+    retrying is explicitly requested.
+    """
+
+    idempotent_methods = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+    def __init__(self, max_retries=3, backoff_factor=0.5, max_backoff=30.0,
+                 jitter=True, retry_statuses=(429, 502, 503, 504)):
+        """
+        :param max_retries: maximum number of retries for each request
+        :param backoff_factor:
+            the delay before the n-th retry is
+            ``backoff_factor * 2 ** (n - 1)`` seconds
+        :param max_backoff: maximum delay between retries, in seconds
+        :param jitter:
+            if True, use a random delay between zero and the one
+            calculated above ("full jitter"), to prevent retries from
+            concurrent clients from piling up.
+        :param retry_statuses: HTTP status codes to be retried
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = retry_statuses
+
+    def is_idempotent(self, method):
+        return method.upper() in self.idempotent_methods
+
+    def is_retriable_error(self, error):
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+        if isinstance(error, HTTPError):
+            return error.status_code in self.retry_statuses
+        return False
+
+    def get_delay(self, attempt, response=None):
+        """
+        Get the delay before the next retry.
+
+        :param attempt: number of retries already performed
+        :param response: the failed response, if any
+        """
+        delay = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+
+        ## Honor the Retry-After header, if specified in seconds
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                pass
+            else:
+                delay = max(delay, min(self.max_backoff, retry_after))
+
+        return delay
+
+
+class Counters(object):
+    """
+    Thread-safe counters, used to keep client metrics.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, value=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def get(self, name, default=0):
+        with self._lock:
+            return self._values.get(name, default)
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class CountingHTTPAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTP adapter counting the sockets actually opened, in
+    ``counters.get('connects')``.
+
+    urllib3 own ``num_connections`` only counts connection objects:
+    when a kept-alive socket gets closed (by the server, or because
+    we asked for ``Connection: close``) the same object reconnects
+    without being counted again.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.counters = Counters()
+        super(CountingHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(CountingHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self._count_connects(self.poolmanager)
+
+    def _count_connects(self, manager):
+        counters = self.counters
+        pool_classes = {}
+        for scheme, pool_cls in manager.pool_classes_by_scheme.iteritems():
+            base_conn_cls = pool_cls.ConnectionCls
+
+            class CountingConnection(base_conn_cls):
+                def connect(self, _base=base_conn_cls):
+                    counters.add('connects')
+                    return _base.connect(self)
+
+            pool_classes[scheme] = type(
+                pool_cls.__name__, (pool_cls,),
+                {'ConnectionCls': CountingConnection})
+        manager.pool_classes_by_scheme = pool_classes
+
+
 ##----------------------------------------------------------------------
 ## Actual client classes
 ##----------------------------------------------------------------------
 
 
 class CkanClient(object):
-    def __init__(self, base_url, api_key=None):
+    def __init__(self, base_url, api_key=None, pool_connections=10,
+                 pool_maxsize=10, pool_block=False, keep_alive=True,
+                 session=None, limiter=None, retry_policy=None, codec=None,
+                 compress_threshold=None):
+        """
+        :param base_url: base URL of the Ckan instance
+        :param api_key: API key used for authenticated requests
+
+        :param pool_connections:
+            number of per-host connection pools to keep around
+        :param pool_maxsize:
+            maximum number of connections kept open for each host
+        :param pool_block:
+            if True, block when all the connections to a host are busy,
+            instead of opening a new (throw-away) one. Use this to
+            strictly enforce the per-host limit.
+        :param keep_alive:
+            if False, ask the server to close connections after
+            each request (mostly for debugging)
+        :param session:
+            a ``requests.Session`` to be shared with other clients.
+            If omitted, a new pooled session will be created.
+        :param limiter:
+            an ``AdaptiveLimiter`` used to adapt the number of
+            concurrent requests to the server capacity.
+            If omitted, concurrency is not limited.
+        :param retry_policy:
+            a ``RetryPolicy`` used to retry failed requests.
+            Defaults to ``RetryPolicy()``; pass False to disable retries.
+        :param codec:
+            a ``JsonCodec`` used to encode / decode JSON bodies.
+            Defaults to the fastest one available.
+        :param compress_threshold:
+            if specified, request bodies larger than this (in bytes)
+            will be sent gzip-compressed. Beware that Ckan itself
+            doesn't decompress requests: this needs support from
+            a proxy in front of it. Responses are always requested
+            compressed.
+        """
         self.base_url = base_url
         self.api_key = api_key
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        if session is None:
+            session = self._create_session()
+        self.session = session
+        self.limiter = limiter
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy or None
+        self.codec = codec or JsonCodec()
+        self.compress_threshold = compress_threshold
+
+        ## Metrics, see the ``metrics()`` method
+        self.counters = Counters()
+
+    def _create_session(self):
+        """
+        Create a session with a connection pool shared by all the
+        requests performed by this client.
+
+        ``requests.Session`` (actually, the urllib3 pool manager behind
+        it) can be safely shared across threads, as long as we don't
+        mess with its configuration after creation.
+        """
+        session = requests.Session()
+        adapter = CountingHTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
     @property
     def anonymous(self):
-        return CkanClient(self.base_url)
+        ## Authorization is per-request, so we can share the pool
+        client = CkanClient(self.base_url, session=self.session,
+                            keep_alive=self.keep_alive, limiter=self.limiter,
+                            retry_policy=self.retry_policy or False,
+                            codec=self.codec,
+                            compress_threshold=self.compress_threshold)
+        client.counters = self.counters
+        return client
+
+    def close(self):
+        """Close all the connections in the pool"""
+        self.session.close()
+
+    def pool_stats(self):
+        """
+        Get statistics about the connection pools.
+
+        :return: a dict with the following keys:
+            - pools: number of per-host pools
+            - requests: number of requests served by the pools
+            - connections: number of connections (sockets) opened
+              so far. Only accurate for the session created by the
+              client: for custom sessions, reconnections are not
+              counted.
+            - reused: number of requests that reused a connection
+            - reuse_ratio: reused / requests (0.0 if no requests yet)
+            - idle_sockets: open connections waiting in the pools
+        """
+        stats = {
+            'pools': 0,
+            'requests': 0,
+            'connections': 0,
+            'idle_sockets': 0,
+        }
+        seen_adapters = set()
+        for adapter in self.session.adapters.itervalues():
+            if id(adapter) in seen_adapters:
+                continue
+            seen_adapters.add(id(adapter))
+            poolmanager = getattr(adapter, 'poolmanager', None)
+            if poolmanager is None:
+                continue
+            counting = isinstance(adapter, CountingHTTPAdapter)
+            if counting:
+                stats['connections'] += adapter.counters.get('connects')
+            for key in poolmanager.pools.keys():
+                pool = poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                stats['pools'] += 1
+                stats['requests'] += pool.num_requests
+                if not counting:
+                    stats['connections'] += pool.num_connections
+                stats['idle_sockets'] += sum(
+                    1 for conn in list(pool.pool.queue)
+                    if conn is not None and conn.sock is not None)
+        stats['reused'] = max(0, stats['requests'] - stats['connections'])
+        stats['reuse_ratio'] = (
+            float(stats['reused']) / stats['requests']
+            if stats['requests'] else 0.0)
+        return stats
+
+    def metrics(self):
+        """
+        Get metrics about requests performed by this client.
+
+        :return: a dict with the following keys:
+            - retries: total number of retries
+            - retried_requests: number of requests retried at least once
+            - retry_time: seconds spent retrying (waiting + failed
+              attempts), from the first failure of each request
+            - retry_failures: number of requests failed after retrying
+            - request_bytes: size of request bodies, as sent
+            - request_bytes_saved: bytes saved by compressing requests
+            - response_bytes: size of response bodies, as received
+            - response_bytes_saved: bytes saved by compressed responses
+        """
+        metrics = {
+            'retries': 0,
+            'retried_requests': 0,
+            'retry_time': 0.0,
+            'retry_failures': 0,
+            'request_bytes': 0,
+            'request_bytes_saved': 0,
+            'response_bytes': 0,
+            'response_bytes_saved': 0,
+        }
+        metrics.update(self.counters.as_dict())
+        return metrics
+
+    def concurrency_stats(self):
+        """
+        Get statistics from the concurrency limiter, if any.
+        See ``AdaptiveLimiter.stats()``.
+        """
+        if self.limiter is None:
+            return None
+        return self.limiter.stats()
+
+    def _send(self, method, url, **kwargs):
+        """
+        Send a request through the session, respecting the
+        concurrency limit (if any).
+        """
+        if self.limiter is None:
+            response = self.session.request(method, url, **kwargs)
+
+        else:
+            token = self.limiter.acquire()
+            start = time.time()
+            overloaded = True  # unless we get a response
+            try:
+                response = self.session.request(method, url, **kwargs)
+                overloaded = response.status_code in OVERLOAD_STATUS_CODES
+            finally:
+                self.limiter.release(token, time.time() - start, overloaded)
+
+        ## Streamed responses are counted once consumed
+        if not kwargs.get('stream'):
+            self._count_response(response, len(response.content))
+
+        return response
+
+    def _count_response(self, response, size):
+        """
+        Update metrics with the size of a response body.
+
+        :param size: size of the (decoded) response body
+        """
+        try:
+            received = response.raw.tell()  # bytes read from the wire
+        except (AttributeError, TypeError, ValueError):
+            received = size
+        self.counters.add('response_bytes', received)
+        self.counters.add('response_bytes_saved', max(0, size - received))
+
+    def _compress(self, data):
+        """gzip-compress a request body"""
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def request(self, method, path, retry=None, **kwargs):
+        """
+        Perform a request to the API.
+
+        :param method: HTTP method
+        :param path: path, relative to the base URL (or list of segments)
+        :param retry:
+            whether to retry the request on (transient) failures,
+            following the client retry policy. If None, only
+            idempotent requests are retried.
+        :param kwargs: passed to ``requests.Session.request()``
+        :raises HTTPError: if the response status is not "ok"
+        """
 
-    def request(self, method, path, **kwargs):
         headers = kwargs.get('headers') or {}
         kwargs['headers'] = headers
 
@@ -232,28 +984,282 @@ class CkanClient(object):
         if self.api_key is not None:
             headers['Authorization'] = self.api_key
 
+        if not self.keep_alive:
+            headers['Connection'] = 'close'
+
         ## Serialize data to json, if not already
         if 'data' in kwargs:
             if not isinstance(kwargs['data'], basestring):
-                kwargs['data'] = json.dumps(kwargs['data'])
+                kwargs['data'] = self.codec.dumps(kwargs['data'])
                 headers['content-type'] = 'application/json'
 
+        ## Compress large bodies, if enabled
+        data = kwargs.get('data')
+        if isinstance(data, basestring):
+            size = len(data)
+            if self.compress_threshold is not None \
+                    and size > self.compress_threshold:
+                kwargs['data'] = self._compress(data)
+                headers['Content-Encoding'] = 'gzip'
+                self.counters.add('request_bytes_saved',
+                                  size - len(kwargs['data']))
+            self.counters.add('request_bytes', len(kwargs['data']))
+
         if isinstance(path, (list, tuple)):
             path = '/'.join(path)
 
         url = urlparse.urljoin(self.base_url, path)
-        response = requests.request(method, url, **kwargs)
-        if not response.ok:
-            ## todo: attach message, if any available..
-            ## todo: we should find a way to figure out how to attach
-            ##       original text message to the exception
-            ##       as it might be: json string, part of json object,
-            ##       part of html document
-            raise HTTPError(response.status_code,
-                            "Error while performing request")
+
+        policy = self.retry_policy
+        if policy is None:
+            retry = False
+        elif retry is None:
+            retry = policy.is_idempotent(method)
+
+        attempt = 0
+        first_failure = None
+        while True:
+            response, error = None, None
+            try:
+                response = self._send(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.ok:
+                    break
+                ## todo: attach message, if any available..
+                ## todo: we should find a way to figure out how to attach
+                ##       original text message to the exception
+                ##       as it might be: json string, part of json object,
+                ##       part of html document
+                error = HTTPError(response.status_code,
+                                  "Error while performing request")
+                ## Release the connection to the pool: the body of
+                ## failed (streamed) responses is never read
+                response.close()
+
+            if not (retry and policy.is_retriable_error(error)
+                    and attempt < policy.max_retries):
+                if first_failure is not None:
+                    self.counters.add('retry_failures')
+                    self.counters.add('retry_time',
+                                      time.time() - first_failure)
+                raise error
+
+            if first_failure is None:
+                first_failure = time.time()
+                self.counters.add('retried_requests')
+            self.counters.add('retries')
+            time.sleep(policy.get_delay(attempt, response))
+            attempt += 1
+
+        if first_failure is not None:
+            self.counters.add('retry_time', time.time() - first_failure)
 
         return response
 
+    def _decode(self, response):
+        """Decode a JSON response body"""
+        return self.codec.loads(response.content)
+
+    def _post_create(self, path, obj, lookup, decode):
+        """
+        POST a new object.
+
+        Creates are not idempotent: if the request failed after
+        reaching the server, the object might have been created anyway.
+        So, on failure, the request is retried only after
+        ``lookup(obj['name'])`` confirmed the object doesn't exist;
+        if it does, it is returned instead, provided it matches what
+        we sent (see ``_is_posted_object()``). Otherwise, the name is
+        taken by another object and the original error is raised.
+
+        :param lookup: function to retrieve an object by name
+        :param decode: function to extract the object from the response
+        """
+        policy = self.retry_policy
+        name = obj.get('name')
+
+        attempt = 0
+        first_failure = None
+        while True:
+            try:
+                created = decode(self.request('POST', path, retry=False,
+                                              data=obj))
+            except Exception as e:
+                if (policy is None or name is None
+                        or not policy.is_retriable_error(e)
+                        or attempt >= policy.max_retries):
+                    if first_failure is not None:
+                        self.counters.add('retry_failures')
+                        self.counters.add('retry_time',
+                                          time.time() - first_failure)
+                    raise
+                error = e
+            else:
+                break
+
+            if first_failure is None:
+                first_failure = time.time()
+                self.counters.add('retried_requests')
+
+            ## Was the object created anyway?
+            try:
+                found = lookup(name)
+            except HTTPError as e:
+                if e.status_code != 404:
+                    raise
+                found = None
+            if found is not None and found.get('state') != 'deleted':
+                if not self._is_posted_object(obj, found):
+                    self.counters.add('retry_failures')
+                    self.counters.add('retry_time',
+                                      time.time() - first_failure)
+                    raise error
+                created = found
+                break
+
+            self.counters.add('retries')
+            time.sleep(policy.get_delay(attempt))
+            attempt += 1
+
+        if first_failure is not None:
+            self.counters.add('retry_time', time.time() - first_failure)
+
+        return created
+
+    def _is_posted_object(self, obj, found):
+        """
+        Check whether an object found by name, after a failed create,
+        is the one we posted (rather than a pre-existing one):
+        its title and extras must match the ones we sent.
+        """
+        def _extras(o):
+            extras = o.get('extras') or {}
+            if isinstance(extras, list):
+                extras = dict((x['key'], x['value']) for x in extras)
+            return extras
+
+        if 'title' in obj and found.get('title') != obj['title']:
+            return False
+        found_extras = _extras(found)
+        return all(found_extras.get(key) == value
+                   for key, value in _extras(obj).iteritems())
+
+    def _iter_list(self, path, item_type=None, chunk_size=64 * 1024):
+        """
+        GET a JSON list, yielding items while the response
+        is being downloaded. See ``iter_json_list()``.
+
+        :param item_type: if specified, check the type of each item
+        """
+        response = self.request('GET', path, stream=True)
+        received = [0]
+
+        def _count(chunks):
+            for chunk in chunks:
+                received[0] += len(chunk)
+                yield chunk
+
+        try:
+            chunks = _count(response.iter_content(chunk_size=chunk_size))
+            for item in iter_json_list(chunks, response.encoding or 'utf-8'):
+                if item_type is not None \
+                        and not isinstance(item, item_type):
+                    raise TypeError("A value in the list is not a {0!r}"
+                                    .format(item_type))
+                yield item
+        finally:
+            self._count_response(response, received[0])
+            response.close()
+
+    def _iter_objects(self, fetch, object_ids, workers=None, prefetch=None,
+                      ordered=True, executor=None):
+        """
+        Call ``fetch(object_id)`` for each id, yield the results.
+
+        If neither ``workers`` nor ``prefetch`` are specified, objects
+        are just fetched one after the other. Otherwise, up to
+        ``prefetch`` fetches are kept in flight on a pool of ``workers``
+        threads.
+
+        :param workers:
+            number of threads used to fetch objects.
+            Defaults to ``prefetch``.
+        :param prefetch:
+            maximum number of fetches "in flight" at any given time.
+            Defaults to twice the number of workers.
+        :param ordered:
+            if True, objects are yielded in the same order as ids.
+            Otherwise, they are yielded as soon as they are ready.
+        :param executor:
+            an existing executor to submit fetches to, instead of
+            creating a new pool of ``workers`` threads. It won't be
+            shut down when done.
+
+        :raises FetchError:
+            as soon as one of the fetches fails; the failing id is
+            stored in ``object_id``, the original exception in ``error``.
+        """
+
+        if workers is None and prefetch is None:
+            for object_id in object_ids:
+                yield fetch(object_id)
+            return
+
+        if workers is None:
+            workers = prefetch
+        if prefetch is None:
+            prefetch = workers * 2
+
+        object_ids = iter(object_ids)
+        own_executor = executor is None
+        if own_executor:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers)
+        in_flight = OrderedDict()  # future -> object_id
+
+        def _submit():
+            for object_id in object_ids:
+                in_flight[executor.submit(fetch, object_id)] = object_id
+                return True
+            return False
+
+        try:
+            while len(in_flight) < prefetch and _submit():
+                pass
+
+            while len(in_flight) > 0:
+                concurrent.futures.wait(
+                    [f for f in in_flight if not f.done()],
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+
+                ## Fail as soon as anything went wrong, even if
+                ## we are still waiting for previous objects
+                for future, object_id in in_flight.iteritems():
+                    if future.done() and future.exception() is not None:
+                        raise FetchError(object_id, future.exception())
+
+                if ordered:
+                    ready = []
+                    for future in in_flight:
+                        if not future.done():
+                            break
+                        ready.append(future)
+                else:
+                    ready = [f for f in in_flight if f.done()]
+
+                for future in ready:
+                    del in_flight[future]
+                    _submit()
+                    yield future.result()
+
+        finally:
+            for future in in_flight:
+                future.cancel()
+            if own_executor:
+                executor.shutdown(wait=False)
+
     ##============================================================
     ## Datasets
     ##============================================================
@@ -262,25 +1268,157 @@ class CkanClient(object):
     def list_datasets(self):
         path = '/api/2/rest/dataset'
         response = self.request('GET', path)
-        return response.json()
+        return self._decode(response)
+
+    def iter_dataset_ids(self):
+        """
+        Streaming version of ``list_datasets()``: ids are yielded while
+        the list is being downloaded, in constant memory.
+        """
+        return self._iter_list('/api/2/rest/dataset', basestring)
+
+    def iter_datasets(self, workers=None, prefetch=None, ordered=True,
+                      stream=False):
+        """
+        Iterate all the datasets.
+
+        See ``_iter_objects()`` for the meaning of arguments.
+        When using multiple workers, make sure ``pool_maxsize`` is
+        large enough, or connections will not be reused.
 
-    def iter_datasets(self):
-        for ds_id in self.list_datasets():
-            yield self.get_dataset(ds_id)
+        :param stream:
+            if True, start fetching datasets while the list of ids
+            is still being downloaded.
+        """
+        dataset_ids = (self.iter_dataset_ids() if stream
+                       else self.list_datasets())
+        return self._iter_objects(
+            self.get_dataset, dataset_ids, workers=workers,
+            prefetch=prefetch, ordered=ordered)
+
+    @check_retval(dict)
+    def search_datasets(self, q='*:*', fq=None, rows=None, start=None,
+                        sort=None, fl=None, include_private=True):
+        """
+        Low-level wrapper around ``package_search`` (API v3).
+
+        .. warning::
+
+            Datasets are returned "as-is", in API v3 format.
+            Use ``normalize_dataset()`` to convert them to the same
+            format returned by ``get_dataset()``.
+
+        :param include_private:
+            also return private datasets the user has access to
+            (Ckan excludes them by default, unlike ``list_datasets()``)
+
+        :return: a dict with ``count`` and ``results`` keys
+        """
+        params = {'q': q}
+        for key, value in (('fq', fq), ('rows', rows), ('start', start),
+                           ('sort', sort), ('fl', fl)):
+            if value is not None:
+                params[key] = value
+        if include_private:
+            params['include_private'] = 'true'
+        path = '/api/3/action/package_search'
+        response = self.request('GET', path, params=params)
+        return self._decode(response)['result']
+
+    def iter_dataset_pages(self, fq=None, page_size=1000, cursor=False):
+        """
+        Scan the whole catalog (or the subset matching ``fq``), in pages
+        of full datasets, via ``package_search``.
+
+        This requires ``count / page_size`` requests, instead of the
+        ``count + 1`` needed by ``iter_datasets()``.
+
+        :param fq: Solr filter query to restrict the scan
+        :param page_size:
+            number of datasets per page. Beware that Ckan will cap
+            it to its ``search.rows_max`` setting (1000 by default).
+        :param cursor:
+            if True, walk the catalog in ``metadata_modified`` order,
+            using the last seen value as a cursor instead of an offset.
+            This prevents skipping / repeating datasets when the
+            catalog is modified during the scan.
+
+        :return: an iterator of lists of datasets, normalized with
+            ``normalize_dataset()``
+        """
+
+        if not cursor:
+            start = 0
+            while True:
+                result = self.search_datasets(
+                    fq=fq, rows=page_size, start=start, sort='id asc')
+                page = [normalize_dataset(x) for x in result['results']]
+                if len(page) == 0:
+                    return
+                yield page
+                start += len(page)
+                if start >= result['count']:
+                    return
+
+        last_modified = None
+        seen_ids = set()  # datasets already returned at last_modified
+        while True:
+            _fq = [fq] if fq else []
+            if last_modified is not None:
+                _fq.append('metadata_modified:[{0} TO *]'
+                           .format(last_modified))
+            result = self.search_datasets(
+                fq=' '.join(_fq) or None, rows=page_size,
+                sort='metadata_modified asc, id asc')
+            if len(result['results']) == 0:
+                return
+
+            page = []
+            for dataset in result['results']:
+                modified = solr_date(dataset['metadata_modified'])
+                if modified != last_modified:
+                    last_modified = modified
+                    seen_ids = set()
+                if dataset['id'] in seen_ids:
+                    continue
+                seen_ids.add(dataset['id'])
+                page.append(normalize_dataset(dataset))
+
+            if len(page) == 0:
+                ## Only datasets we already returned: the page was
+                ## full of datasets with the same metadata_modified,
+                ## meaning we cannot make any further progress.
+                if len(result['results']) >= page_size:
+                    raise BadApiError(
+                        "Too many datasets with metadata_modified={0}, "
+                        "try increasing page_size".format(last_modified))
+                return
+            yield page
+
+    def scan_datasets(self, fq=None, page_size=1000, cursor=False):
+        """
+        Iterate all the datasets using paged searches.
+        See ``iter_dataset_pages()`` for the arguments.
+        """
+        for page in self.iter_dataset_pages(
+                fq=fq, page_size=page_size, cursor=cursor):
+            for dataset in page:
+                yield dataset
 
     @check_arg_types(None, basestring)
     @check_retval(dict)
     def get_dataset(self, dataset_id):
         path = '/api/2/rest/dataset/{0}'.format(dataset_id)
         response = self.request('GET', path)
-        return response.json()
+        return self._decode(response)
 
     @check_arg_types(None, dict)
     @check_retval(dict)
     def post_dataset(self, dataset):
         path = '/api/2/rest/dataset'
-        response = self.request('POST', path, data=dataset)
-        return response.json()
+        return self._post_create(
+            path, dataset, lookup=self.get_dataset,
+            decode=self._decode)
 
     @check_arg_types(None, validate_dataset)
     @check_retval(dict)
@@ -308,11 +1446,11 @@ class CkanClient(object):
         """
         path = '/api/2/rest/dataset/{0}'.format(dataset_id)
         response = self.request('PUT', path, data=dataset)
-        return response.json()
+        return self._decode(response)
 
-    @check_arg_types(None, basestring, validate_dataset)
+    @check_arg_types(None, basestring, validate_dataset, replace_extras=bool)
     @check_retval(dict)
-    def update_dataset(self, dataset_id, updates):
+    def update_dataset(self, dataset_id, updates, replace_extras=False):
         """
         Trickery to perform a safe partial update of a dataset.
 
@@ -334,6 +1472,11 @@ class CkanClient(object):
 
         - If the groups field is not specified on update, all groups will
           be removed. To prevent this, we default it to [].
+
+        :param replace_extras:
+            if True, the extras in ``updates`` replace the existing
+            ones, instead of being merged: extras not in ``updates``
+            are deleted.
         """
 
         ##=====[!!]=========== IMPORTANT NOTE ===============[!!]=====
@@ -386,6 +1529,11 @@ class CkanClient(object):
 
         updates_dict[EXTRAS_FIELD] = {}
 
+        if replace_extras:
+            ## Extras need to be explicitly deleted
+            for key in original_dataset.get(EXTRAS_FIELD) or {}:
+                updates_dict[EXTRAS_FIELD][key] = None
+
         if EXTRAS_FIELD in updates:
             # Notes: setting a field to 'None' will delete it.
             updates_dict[EXTRAS_FIELD].update(updates[EXTRAS_FIELD])
@@ -417,8 +1565,8 @@ class CkanClient(object):
         ##============================================================
 
         updates_dict['groups'] = (
-            updates['group']
-            if 'group' in updates
+            updates['groups']
+            if 'groups' in updates
             else original_dataset['groups'])
 
         ##############################################################
@@ -462,33 +1610,40 @@ class CkanClient(object):
     def list_groups(self):
         path = '/api/2/rest/group'
         response = self.request('GET', path)
-        return response.json()
+        return self._decode(response)
+
+    def iter_group_ids(self):
+        """Streaming version of ``list_groups()``"""
+        return self._iter_list('/api/2/rest/group', basestring)
 
-    def iter_groups(self):
-        all_groups = self.list_groups()
-        for group_id in all_groups:
-            yield self.get_group(group_id)
+    def iter_groups(self, workers=None, prefetch=None, ordered=True,
+                    stream=False):
+        group_ids = self.iter_group_ids() if stream else self.list_groups()
+        return self._iter_objects(
+            self.get_group, group_ids, workers=workers,
+            prefetch=prefetch, ordered=ordered)
 
     @check_arg_types(None, basestring)
     @check_retval(dict)
     def get_group(self, group_id):
         path = '/api/2/rest/group/{0}'.format(group_id)
         response = self.request('GET', path)
-        return response.json()
+        return self._decode(response)
 
     @check_arg_types(None, dict)
     @check_retval(dict)
     def post_group(self, group):
         path = '/api/2/rest/group'
-        response = self.request('POST', path, data=group)
-        return response.json()
+        return self._post_create(
+            path, group, lookup=self.get_group,
+            decode=self._decode)
 
     @check_arg_types(None, basestring, dict)
     @check_retval(dict)
     def put_group(self, group_id, group):
         path = '/api/2/rest/group/{0}'.format(group_id)
         response = self.request('PUT', path, data=group)
-        data = response.json()
+        data = self._decode(response)
         return data
 
     @check_arg_types(None, basestring, ignore_404=bool)
@@ -500,7 +1655,7 @@ class CkanClient(object):
             self.request('DELETE', path)
         path = '/api/3/action/group_purge'
         with ign404:
-            self.request('POST', path, data={'id': group_id})
+            self.request('POST', path, retry=True, data={'id': group_id})
 
     @check_arg_types(None, basestring, dict)
     @check_retval(dict)
@@ -610,32 +1765,34 @@ class CkanClient(object):
     def list_organizations(self):
         path = '/api/3/action/organization_list'
         response = self.request('GET', path)
-        return response.json()['result']
+        return self._decode(response)['result']
 
-    def iter_organizations(self):
-        for org_id in self.list_organizations():
-            yield self.get_organization(org_id)
+    def iter_organizations(self, workers=None, prefetch=None, ordered=True):
+        return self._iter_objects(
+            self.get_organization, self.list_organizations(),
+            workers=workers, prefetch=prefetch, ordered=ordered)
 
     @check_arg_types(None, basestring)
     @check_retval(dict)
     def get_organization(self, organization_id):
         path = '/api/3/action/organization_show?id={0}'.format(organization_id)
         response = self.request('GET', path)
-        return response.json()['result']
+        return self._decode(response)['result']
 
     @check_retval(dict)
     def post_organization(self, organization):
         path = '/api/3/action/organization_create'
-        response = self.request('POST', path, data=organization)
-        return response.json()['result']
+        return self._post_create(
+            path, organization, lookup=self.get_organization,
+            decode=lambda response: self._decode(response)['result'])
 
     @check_retval(dict)
     def put_organization(self, organization_id, organization):
         """Warning! with api v3 we need to use POST!"""
         organization['id'] = organization_id
         path = '/api/3/action/organization_update'
-        response = self.request('POST', path, data=organization)
-        return response.json()['result']
+        response = self.request('POST', path, retry=True, data=organization)
+        return self._decode(response)['result']
 
     @check_arg_types(None, basestring, dict)
     @check_retval(dict)
@@ -746,7 +1903,8 @@ class CkanClient(object):
             self.request('PUT', path, data={'id': organization_id})
         path = '/api/3/action/organization_purge'
         with ign404:
-            self.request('POST', path, data={'id': organization_id})
+            self.request('POST', path, retry=True,
+                         data={'id': organization_id})
 
     ##============================================================
     ## Licenses
@@ -756,7 +1914,7 @@ class CkanClient(object):
     def list_licenses(self):
         path = '/api/2/rest/licenses'
         response = self.request('GET', path)
-        return response.json()
+        return self._decode(response)
 
     ##============================================================
     ## Tags
@@ -766,22 +1924,339 @@ class CkanClient(object):
     def list_tags(self):
         path = '/api/2/rest/tag'
         response = self.request('GET', path)
-        return response.json()
+        return self._decode(response)
+
+    def iter_tag_ids(self):
+        """Streaming version of ``list_tags()``"""
+        return self._iter_list('/api/2/rest/tag', basestring)
 
     @check_retval(is_list_of(dict))
     def list_datasets_with_tag(self, tag_id):
         path = '/api/2/rest/tag/{0}'.format(tag_id)
         response = self.request('GET', path)
-        return response.json()
+        return self._decode(response)
+
+    def iter_datasets_with_tag(self, tag_id, workers=None, prefetch=None,
+                               ordered=True):
+        """
+        Iterate all the datasets with a tag, retrieved in full.
+        See ``_iter_objects()`` for the meaning of arguments.
+        """
+        dataset_ids = [x['id'] for x in self.list_datasets_with_tag(tag_id)]
+        return self._iter_objects(
+            self.get_dataset, dataset_ids, workers=workers,
+            prefetch=prefetch, ordered=ordered)
+
+
+def _async_method(name):
+    """Build an AsyncCkanClient method wrapping ``CkanClient.<name>()``"""
+    def method(self, *a, **kw):
+        return self.submit(getattr(self.client, name), *a, **kw)
+    method.__name__ = name
+    method.__doc__ = ("Asynchronous version of ``CkanClient.{0}()``, "
+                      "returns a future.".format(name))
+    return method
+
+
+class AsyncCkanClient(object):
+    """
+    Asynchronous flavor of the Ckan client.
 
-    def iter_datasets_with_tag(self, tag_id):
-        for dataset_id in self.list_datasets_with_tag():
-            yield self.get_dataset(dataset_id)
+    Exposes the same methods as ``CkanClient``, but each call returns
+    immediately a ``concurrent.futures.Future``, while the actual
+    request is performed on a pool of worker threads sharing the
+    same connection pool.
+
+    .. warning::
+
+        This is *not* an event-loop based client: each request in
+        flight occupies a worker thread (and a pooled connection)
+        until it completes, so at most ``max_concurrency`` requests
+        are in flight at any given time. ``max_pending`` only bounds
+        how many calls can be queued waiting for a worker, to apply
+        backpressure to producers; it doesn't increase concurrency.
+        Raising ``max_concurrency`` to the thousands is possible,
+        but costs a thread (with its stack) per request in flight.
+
+    Methods returning iterators (``iter_*``, ``scan_datasets()``)
+    are not asynchronous: they return blocking iterators, fetching
+    objects concurrently on the same workers pool where possible.
+
+    Example::
+
+        client = AsyncCkanClient(base_url, api_key, max_concurrency=20)
+        futures = [client.get_dataset(x) for x in dataset_ids]
+        datasets = [f.result() for f in futures]
+    """
+
+    def __init__(self, base_url, api_key=None, max_concurrency=20,
+                 max_pending=None, client=None, **kwargs):
+        """
+        :param base_url: passed to CkanClient constructor
+        :param api_key: passed to CkanClient constructor
+        :param max_concurrency:
+            maximum number of requests running at the same time,
+            ie. the number of worker threads.
+        :param max_pending:
+            maximum number of submitted calls not completed yet
+            (running + queued). When the limit is reached, calls
+            block until a slot is freed. Defaults to
+            ``100 * max_concurrency``.
+        :param client:
+            a ``CkanClient`` to be used instead of creating a new one
+        :param kwargs:
+            extra arguments passed to the CkanClient constructor
+        """
+        if client is None:
+            kwargs.setdefault('pool_maxsize', max_concurrency)
+            client = CkanClient(base_url, api_key, **kwargs)
+        if max_pending is None:
+            max_pending = 100 * max_concurrency
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._semaphore = threading.BoundedSemaphore(max_pending)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self, wait=True):
+        """Shut down the workers pool and close connections"""
+        self._executor.shutdown(wait=wait)
+        self.client.close()
+
+    def submit(self, func, *a, **kw):
+        """
+        Schedule ``func(*a, **kw)`` for execution on the workers pool.
+
+        :return: a ``concurrent.futures.Future``
+        """
+        self._semaphore.acquire()
+        try:
+            future = self._executor.submit(func, *a, **kw)
+        except:
+            self._semaphore.release()
+            raise
+        future.add_done_callback(lambda f: self._semaphore.release())
+        return future
+
+    def _iter_objects(self, fetch, object_ids, ordered=True, prefetch=None):
+        """Fetch objects concurrently on the workers pool"""
+        if prefetch is None:
+            prefetch = 2 * self.max_concurrency
+        return self.client._iter_objects(
+            fetch, object_ids, prefetch=prefetch, ordered=ordered,
+            executor=self._executor)
+
+    request = _async_method('request')
+
+    def pool_stats(self):
+        """See ``CkanClient.pool_stats()``"""
+        return self.client.pool_stats()
+
+    def metrics(self):
+        """See ``CkanClient.metrics()``"""
+        return self.client.metrics()
+
+    def concurrency_stats(self):
+        """See ``CkanClient.concurrency_stats()``"""
+        return self.client.concurrency_stats()
+
+    ##============================================================
+    ## Datasets
+    ##============================================================
+
+    list_datasets = _async_method('list_datasets')
+    search_datasets = _async_method('search_datasets')
+    get_dataset = _async_method('get_dataset')
+    post_dataset = _async_method('post_dataset')
+    create_dataset = _async_method('create_dataset')
+    put_dataset = _async_method('put_dataset')
+    update_dataset = _async_method('update_dataset')
+    delete_dataset = _async_method('delete_dataset')
+
+    def iter_dataset_ids(self):
+        """Blocking, see ``CkanClient.iter_dataset_ids()``"""
+        return self.client.iter_dataset_ids()
+
+    def iter_datasets(self, ordered=True, prefetch=None, stream=False):
+        """Iterate all the datasets, fetched on the workers pool"""
+        dataset_ids = (self.client.iter_dataset_ids() if stream
+                       else self.client.list_datasets())
+        return self._iter_objects(
+            self.client.get_dataset, dataset_ids, prefetch=prefetch,
+            ordered=ordered)
+
+    def iter_dataset_pages(self, fq=None, page_size=1000, cursor=False):
+        """
+        Blocking, see ``CkanClient.iter_dataset_pages()``.
+        Pages are requested one at a time, as each depends
+        on the previous one.
+        """
+        return self.client.iter_dataset_pages(
+            fq=fq, page_size=page_size, cursor=cursor)
+
+    def scan_datasets(self, fq=None, page_size=1000, cursor=False):
+        """Blocking, see ``CkanClient.scan_datasets()``"""
+        return self.client.scan_datasets(
+            fq=fq, page_size=page_size, cursor=cursor)
+
+    ##============================================================
+    ## Groups
+    ##============================================================
+
+    list_groups = _async_method('list_groups')
+    get_group = _async_method('get_group')
+    post_group = _async_method('post_group')
+    put_group = _async_method('put_group')
+    delete_group = _async_method('delete_group')
+    update_group = _async_method('update_group')
+    upsert_group = _async_method('upsert_group')
+
+    def iter_group_ids(self):
+        """Blocking, see ``CkanClient.iter_group_ids()``"""
+        return self.client.iter_group_ids()
+
+    def iter_groups(self, ordered=True, prefetch=None, stream=False):
+        """Iterate all the groups, fetched on the workers pool"""
+        group_ids = (self.client.iter_group_ids() if stream
+                     else self.client.list_groups())
+        return self._iter_objects(
+            self.client.get_group, group_ids, prefetch=prefetch,
+            ordered=ordered)
+
+    ##============================================================
+    ## Organizations
+    ##============================================================
+
+    list_organizations = _async_method('list_organizations')
+    get_organization = _async_method('get_organization')
+    post_organization = _async_method('post_organization')
+    put_organization = _async_method('put_organization')
+    update_organization = _async_method('update_organization')
+    upsert_organization = _async_method('upsert_organization')
+    delete_organization = _async_method('delete_organization')
+
+    def iter_organizations(self, ordered=True, prefetch=None):
+        """Iterate all the organizations, fetched on the workers pool"""
+        return self._iter_objects(
+            self.client.get_organization, self.client.list_organizations(),
+            prefetch=prefetch, ordered=ordered)
+
+    ##============================================================
+    ## Licenses
+    ##============================================================
+
+    list_licenses = _async_method('list_licenses')
+
+    ##============================================================
+    ## Tags
+    ##============================================================
+
+    list_tags = _async_method('list_tags')
+    list_datasets_with_tag = _async_method('list_datasets_with_tag')
+
+    def iter_tag_ids(self):
+        """Blocking, see ``CkanClient.iter_tag_ids()``"""
+        return self.client.iter_tag_ids()
+
+    def iter_datasets_with_tag(self, tag_id, ordered=True, prefetch=None):
+        """Iterate the datasets with a tag, fetched on the workers pool"""
+        dataset_ids = [x['id']
+                       for x in self.client.list_datasets_with_tag(tag_id)]
+        return self._iter_objects(
+            self.client.get_dataset, dataset_ids, prefetch=prefetch,
+            ordered=ordered)
 
 
 IDPair = namedtuple('IDPair', ['source_id', 'ckan_id'])
 
 
+class SyncState(object):
+    """
+    Persistent state of the data imported from a source, stored
+    in a JSON file between runs of ``CkanDataImportClient.sync_data()``.
+
+    - ``datasets`` maps source ids to dicts with ``ckan_id``,
+      ``hash`` (fingerprint of the dataset we sent to Ckan) and
+      ``metadata_modified`` (as returned by Ckan after our last write)
+
+    - ``last_modified`` is the highest ``metadata_modified`` seen
+      while scanning Ckan; anything modified after that needs to
+      be checked again.
+    """
+
+    def __init__(self, path, source_name):
+        self.path = path
+        self.source_name = source_name
+        self.datasets = {}
+        self.last_modified = None
+        self.load()
+
+    def load(self):
+        """Load state from file, if it exists"""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+
+        if data.get('source_name') != self.source_name:
+            warnings.warn("Ignoring sync state for a different source: {0!r}"
+                          .format(data.get('source_name')))
+            return
+
+        self.datasets = data['datasets']
+        self.last_modified = data['last_modified']
+
+    def save(self):
+        """Atomically write state to file"""
+        data = {
+            'source_name': self.source_name,
+            'last_modified': self.last_modified,
+            'datasets': self.datasets,
+        }
+        tmp_path = '{0}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, self.path)
+
+    def update(self, datasets, last_modified, hash_field):
+        """
+        Replace the state with a snapshot of datasets in Ckan.
+
+        :param datasets: dict mapping {<source_id>: <dataset>}
+        :param last_modified: new high-water mark
+        :param hash_field: name of the extra holding the fingerprint
+        """
+        self.datasets = dict(
+            (source_id, {
+                'ckan_id': dataset['id'],
+                'hash': (dataset.get('extras') or {}).get(hash_field),
+                'metadata_modified': solr_date(dataset['metadata_modified']),
+            })
+            for source_id, dataset in datasets.iteritems())
+        if last_modified is not None:
+            self.last_modified = last_modified
+
+    def is_unchanged(self, source_id, dataset):
+        """
+        Check whether a dataset was not modified since we last wrote it
+        """
+        item = self.datasets.get(source_id)
+        if item is None or item['ckan_id'] != dataset['id']:
+            return False
+        return (item['metadata_modified'] ==
+                solr_date(dataset['metadata_modified']))
+
+
 class CkanDataImportClient(object):
     """
     Client to handle importing data in ckan
@@ -806,23 +2281,66 @@ class CkanDataImportClient(object):
 
     source_field_name = '_harvest_source'
     source_id_field_name = '_harvest_source_id'
+    source_hash_field_name = '_harvest_source_hash'
 
-    def __init__(self, base_url, api_key, source_name):
+    def __init__(self, base_url, api_key, source_name, bulk_scan=True,
+                 state_path=None, **kwargs):
         """
         :param base_url: passed to CkanClient constructor
         :param api_key: passed to CkanClient constructor
         :param source_name: identifier of the data source
+        :param bulk_scan:
+            if True, scan the catalog in pages via ``package_search``,
+            instead of retrieving datasets one by one.
+        :param state_path:
+            path to a file used to keep a ``SyncState`` between runs.
+            When available, only datasets modified in Ckan since the
+            last successful run are retrieved. Requires ``bulk_scan``.
+        :param kwargs:
+            extra arguments passed to CkanClient constructor.
+            When using multiple workers, set ``pool_maxsize``
+            accordingly.
         """
-        self.client = CkanClient(base_url, api_key)
+        self.client = CkanClient(base_url, api_key, **kwargs)
         self.source_name = source_name
+        self.bulk_scan = bulk_scan
+        self.state = None
+        if state_path is not None:
+            self.state = SyncState(state_path, source_name)
 
-    def sync_data(self, data, double_check=True):
+    def sync_data(self, data, double_check=True, deep_check=False,
+                  workers=None, concurrency=None):
         """
         Import data into Ckan
 
         :param data:
             Dict (or dict-like) mapping object types to
             dicts (key/object) (key is the original key)
+
+        :param deep_check:
+            if True, datasets whose fingerprint matches the source
+            are compared field by field anyway, to detect changes
+            made in Ckan by somebody else. This requires retrieving
+            full datasets instead of just their ids and fingerprints,
+            and ignores the sync state (if any).
+
+        :param workers:
+            number of threads used to apply creates / updates / removals.
+            If not specified, operations are applied one at a time.
+
+        :param concurrency:
+            dict limiting the number of concurrent operations by type,
+            eg. ``{'create': 4, 'update': 8, 'delete': 2}``.
+            Missing types are only limited by ``workers``.
+
+        :return: a dict with ``created``, ``updated`` and ``deleted``
+            lists of IDPairs, and a ``failed`` list of
+            ``(operation, idpair, exception)`` tuples.
+
+        :raises SomethingWentWrong:
+            if any of the operations failed (after applying all the
+            others), or the double check found inconsistencies.
+            The result is attached to the exception, as ``result``.
         """
 
         ## Used to keep track of the executed operations,
@@ -831,27 +2349,39 @@ class CkanDataImportClient(object):
             'created': [],
             'updated': [],
             'deleted': [],
+            'failed': [],
         }
 
         ##------------------------------------------------------------
         ## Retrieve current database state
         ##------------------------------------------------------------
 
-        used_dataset_names = set()
-        our_datasets_from_ckan = {}  # key: source id
-
-        for dataset in self.client.iter_datasets():
-            if self._is_our_dataset(dataset):
-                key = dataset['extras'][self.source_id_field_name]
-                our_datasets_from_ckan[key] = dataset
-
-            used_dataset_names.add(dataset['name'])
+        ## This snapshot is taken only once, then kept up to date
+        ## with the results of the operations we perform.
+        ## When we have a state from a previous run, only datasets
+        ## modified since then are retrieved (and compared in full
+        ## if somebody else modified them).
+        if (self.state is not None and self.state.last_modified is not None
+                and self.bulk_scan and not deep_check):
+            our_datasets_from_ckan, modified_ids, last_modified = \
+                self._get_changed_datasets()
+        else:
+            our_datasets_from_ckan = self._get_our_datasets(  # key: source id
+                slim=not deep_check)
+            modified_ids = ()
+            last_modified = max([
+                solr_date(x['metadata_modified'])
+                for x in our_datasets_from_ckan.itervalues()] or [None])
 
         ##------------------------------------------------------------
         ## Utility functions
         ##------------------------------------------------------------
 
         def _prepare_group(group):
+            ## Records from the source might be shared (eg. cached),
+            ## leave them untouched
+            group = copy.deepcopy(group)
+
             # The original id is moved into name.
             # Better not messing with these fields..
             group.pop('id', None)
@@ -884,8 +2414,6 @@ class CkanDataImportClient(object):
         ## Obtain differences between datasets
         ##------------------------------------------------------------
 
-        dataset_diffs = self._verify_datasets(data['dataset'])
-
         def _prepare_dataset(dataset):
             """
             Prepare a dataset from an external source for insertion in ckan
@@ -917,13 +2445,23 @@ class CkanDataImportClient(object):
             dataset['extras'][self.source_field_name] = self.source_name
             dataset['extras'][self.source_id_field_name] = source_id
 
+            ## Fingerprint of the prepared dataset, to quickly tell
+            ## whether the one in Ckan is up to date
+            dataset['extras'][self.source_hash_field_name] = \
+                dataset_fingerprint(dataset, self.source_hash_field_name)
+
             return dataset
 
+        dataset_diffs = self._verify_datasets(
+            data['dataset'], our_datasets=our_datasets_from_ckan,
+            prepare=_prepare_dataset, deep_check=deep_check,
+            force_check=modified_ids)
+
         ##----------------------------------------
-        ## Apply creates
+        ## Operations: creates, updates, removals
         ##----------------------------------------
 
-        for idpair in dataset_diffs['missing']:
+        def _create(idpair):
             ## Create dataset with idpair.source_id
             dataset = _prepare_dataset(data['dataset'][idpair.source_id])
 
@@ -934,18 +2472,9 @@ class CkanDataImportClient(object):
 
             # todo: how to generate default name, if not specified?
 
-            created = self.client.create_dataset(dataset)
-
-            ## Add id in the list of created datasets
-            result['created'].append(
-                IDPair(source_id=idpair.source_id,
-                       ckan_id=created['id']))
+            return self.client.create_dataset(dataset)
 
-        ##----------------------------------------
-        ## Apply updates
-        ##----------------------------------------
-
-        for idpair in dataset_diffs['updated']:
+        def _update(idpair):
             assert idpair.source_id is not None
             assert idpair.ckan_id is not None
 
@@ -960,34 +2489,105 @@ class CkanDataImportClient(object):
             # todo: should we change groups / organizations?
             #       Best thing would be to make this configurable
 
-            updated = self.client.update_dataset(idpair.ckan_id, dataset)
+            ## Extras removed from the source must be removed from
+            ## Ckan too, or the stored fingerprint would be a lie
+            updated = self.client.update_dataset(
+                idpair.ckan_id, dataset, replace_extras=True)
             assert updated['id'] == idpair.ckan_id
 
             # todo: check that the update was successful?
             # (check might be done by update_dataset() too..)
 
-            ## Add id in the list of updated datasets
-            result['updated'].append(idpair)
-
-        ##----------------------------------------
-        ## Apply removals
-        ##----------------------------------------
+            return updated
 
-        for idpair in dataset_diffs['deleted']:
+        def _delete(idpair):
             ## Delete dataset
             assert idpair.source_id is None
             assert idpair.ckan_id is not None
             self.client.delete_dataset(idpair.ckan_id)
 
-            result['deleted'].append(idpair)
+        operations = (
+            [('create', x, _create) for x in dataset_diffs['missing']] +
+            [('update', x, _update) for x in dataset_diffs['updated']] +
+            [('delete', x, _delete) for x in dataset_diffs['deleted']])
+
+        ##----------------------------------------
+        ## Apply operations
+        ##----------------------------------------
+
+        ## We need to map ckan ids back to source ids, in order to
+        ## keep the snapshot up to date
+        deleted_source_ids = dict(
+            (d['id'], k) for k, d in our_datasets_from_ckan.iteritems())
+
+        applied = self._apply_operations(
+            operations, workers=workers, concurrency=concurrency)
+
+        for operation, idpair, retval, error in applied:
+            if error is not None:
+                warnings.warn("Failed to {0} dataset {1!r}: {2!r}"
+                              .format(operation, idpair, error))
+                result['failed'].append((operation, idpair, error))
+
+            elif operation == 'create':
+                our_datasets_from_ckan[idpair.source_id] = retval
+
+                ## Add id in the list of created datasets
+                result['created'].append(
+                    IDPair(source_id=idpair.source_id,
+                           ckan_id=retval['id']))
+
+            elif operation == 'update':
+                our_datasets_from_ckan[idpair.source_id] = retval
+
+                ## Add id in the list of updated datasets
+                result['updated'].append(idpair)
+
+            elif operation == 'delete':
+                our_datasets_from_ckan.pop(
+                    deleted_source_ids[idpair.ckan_id])
+                result['deleted'].append(idpair)
+
+        if len(result['failed']) > 0:
+            raise SomethingWentWrong(
+                "{0} operations failed while importing datasets"
+                .format(len(result['failed'])), result=result)
 
         ##----------------------------------------
         ## Double-check
         ##----------------------------------------
 
         if double_check:
+            ## Only re-fetch the datasets we touched, as the rest
+            ## of the snapshot is supposed to be still valid.
+            def _fetch(ckan_id):
+                try:
+                    return self.client.get_dataset(ckan_id)
+                except HTTPError as e:
+                    if e.status_code != 404:
+                        raise
+                    return None
+
+            touched = result['created'] + result['updated']
+            idpairs = touched + result['deleted']
+            fetched = self.client._iter_objects(
+                _fetch, [x.ckan_id for x in idpairs], workers=workers)
+
+            for idpair, dataset in itertools.izip(idpairs, fetched):
+                source_id = idpair.source_id
+                if source_id is None:
+                    source_id = deleted_source_ids[idpair.ckan_id]
+                if dataset is None or dataset['state'] == 'deleted':
+                    ## It will be reported as missing, if it shouldn't
+                    our_datasets_from_ckan.pop(source_id, None)
+                else:
+                    ## Deleted ones are put back, to be reported
+                    our_datasets_from_ckan[source_id] = dataset
+
             errors = 0
-            differences = self._verify_datasets(data['dataset'])
+            differences = self._verify_datasets(
+                data['dataset'], our_datasets=our_datasets_from_ckan,
+                prepare=_prepare_dataset, deep_check=deep_check)
 
             if len(differences['missing']) > 0:
                 errors += 1
@@ -1010,7 +2610,67 @@ class CkanDataImportClient(object):
 
             if errors > 0:
                 raise SomethingWentWrong(
-                    "Something went wrong while performing updates.")
+                    "Something went wrong while performing updates.",
+                    result=result)
+
+        if self.state is not None:
+            self.state.update(our_datasets_from_ckan, last_modified,
+                              self.source_hash_field_name)
+            self.state.save()
+
+        return result
+
+    def _apply_operations(self, operations, workers=None, concurrency=None):
+        """
+        Run a bunch of operations, isolating failures.
+
+        :param operations:
+            list of ``(operation, idpair, function)`` tuples.
+            ``function(idpair)`` will be called to run the operation.
+        :param workers:
+            number of threads to use. If None, operations are run
+            sequentially in the current thread.
+        :param concurrency:
+            dict mapping operation names to the maximum number of
+            concurrent operations of that type.
+
+        :return: an iterator of ``(operation, idpair, retval, error)``
+            tuples, in completion order.
+        """
+
+        def _run(operation, idpair, func):
+            try:
+                return func(idpair), None
+            except Exception as e:
+                return None, e
+
+        if workers is None:
+            for operation, idpair, func in operations:
+                retval, error = _run(operation, idpair, func)
+                yield operation, idpair, retval, error
+            return
+
+        concurrency = concurrency or {}
+        limits = dict(
+            (operation, threading.BoundedSemaphore(
+                concurrency.get(operation, workers)))
+            for operation, _, _ in operations)
+
+        def _run_limited(operation, idpair, func):
+            with limits[operation]:
+                return _run(operation, idpair, func)
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = dict(
+                (executor.submit(_run_limited, *op), op)
+                for op in operations)
+            for future in concurrent.futures.as_completed(futures):
+                operation, idpair, _ = futures[future]
+                retval, error = future.result()
+                yield operation, idpair, retval, error
+        finally:
+            executor.shutdown(wait=True)
 
     def _is_our_dataset(self, dataset):
         """
@@ -1022,14 +2682,164 @@ class CkanDataImportClient(object):
             return False
         return dataset_source == self.source_name
 
-    def _find_our_datasets(self):
+    def _our_datasets_query(self):
+        """
+        Solr filter query matching datasets from this source.
+
+        Extras are indexed by Ckan as ``extras_<key>`` text fields.
+        Since they are tokenized, the query might match more datasets
+        than needed, so results still need checking with
+        ``_is_our_dataset()``.
+        """
+        value = self.source_name.replace('\\', '\\\\').replace('"', '\\"')
+        return 'extras_{0}:"{1}"'.format(self.source_field_name, value)
+
+    def _find_our_datasets(self, slim=False):
         """
         Iterate dataset, yield only the ones that match this source
+
+        :param slim:
+            if True, only retrieve the fields needed to identify
+            datasets and check their fingerprint: ``id``,
+            ``metadata_modified`` and our extras. Only works when
+            bulk scanning; Ckan versions not supporting ``fl`` in
+            searches will just return full datasets.
         """
-        for dataset in self.client.iter_datasets():
+        if self.bulk_scan and slim:
+            datasets = self._scan_slim_datasets()
+        elif self.bulk_scan:
+            datasets = self.client.scan_datasets(
+                fq=self._our_datasets_query())
+        else:
+            datasets = self.client.iter_datasets()
+
+        for dataset in datasets:
+            ## Safety net: the server-side filter is not exact
             if self._is_our_dataset(dataset):
                 yield dataset
 
+    def _scan_slim_datasets(self, since=None):
+        """
+        Scan our datasets, only retrieving ids and fingerprints
+
+        :param since:
+            if specified, only return datasets whose
+            ``metadata_modified`` is greater or equal to this
+            (Solr-formatted) date.
+        """
+        extras_keys = [self.source_field_name, self.source_id_field_name,
+                       self.source_hash_field_name]
+        fl = ' '.join(['id', 'metadata_modified'] +
+                      ['extras_{0}'.format(x) for x in extras_keys])
+        query = self._our_datasets_query()
+        if since is not None:
+            query = '{0} metadata_modified:[{1} TO *]'.format(query, since)
+        start = 0
+        while True:
+            result = self.client.search_datasets(
+                fq=query, fl=fl, rows=1000, start=start, sort='id asc')
+            if len(result['results']) == 0:
+                return
+            for doc in result['results']:
+                if 'extras' in doc:
+                    ## Ckan doesn't support 'fl': got a full dataset
+                    yield normalize_dataset(doc)
+                    continue
+                yield {
+                    'id': doc['id'],
+                    'metadata_modified': doc.get('metadata_modified'),
+                    'extras': dict(
+                        (x, doc['extras_{0}'.format(x)])
+                        for x in extras_keys
+                        if 'extras_{0}'.format(x) in doc),
+                }
+            start += len(result['results'])
+            if start >= result['count']:
+                return
+
+    def _scan_our_dataset_ids(self):
+        """
+        List the ids of our datasets currently in the search index.
+
+        As the server-side filter is not exact, this might include
+        a few ids of datasets from other sources.
+        """
+        start = 0
+        while True:
+            result = self.client.search_datasets(
+                fq=self._our_datasets_query(), fl='id', rows=1000,
+                start=start, sort='id asc')
+            if len(result['results']) == 0:
+                return
+            for doc in result['results']:
+                yield doc['id']
+            start += len(result['results'])
+            if start >= result['count']:
+                return
+
+    def _get_our_datasets(self, slim=False):
+        """
+        Get a snapshot of the datasets associated with this source.
+
+        :param slim: see ``_find_our_datasets()``
+        :return: a dict mapping {<source_id>: <dataset>}
+        """
+        return dict(
+            (x['extras'][self.source_id_field_name], x)
+            for x in self._find_our_datasets(slim=slim))
+
+    def _get_changed_datasets(self):
+        """
+        Build a snapshot of our datasets from the sync state,
+        retrieving only the datasets modified since the last run.
+
+        Datasets we wrote ourselves during the last run are taken
+        from the state; the ones modified by somebody else are
+        retrieved in full, to be compared field by field.
+        Datasets no longer in the search index (eg. deleted by
+        somebody else) are dropped from the snapshot, to be recreated.
+
+        :return: a ``(snapshot, modified_ids, last_modified)`` tuple:
+            the snapshot as returned by ``_get_our_datasets()``, a set
+            of source ids of externally modified datasets and the new
+            ``metadata_modified`` high-water mark.
+        """
+        ## Deleted datasets are not returned by searches, so they
+        ## would never show up as modified since the last run.
+        existing_ids = set(self._scan_our_dataset_ids())
+
+        snapshot = {}
+        for source_id, item in self.state.datasets.iteritems():
+            if item['ckan_id'] not in existing_ids:
+                continue
+            snapshot[source_id] = {
+                'id': item['ckan_id'],
+                'metadata_modified': item['metadata_modified'],
+                'extras': {
+                    self.source_field_name: self.source_name,
+                    self.source_id_field_name: source_id,
+                    self.source_hash_field_name: item['hash'],
+                },
+            }
+
+        modified_ids = set()
+        last_modified = self.state.last_modified
+        for dataset in self._scan_slim_datasets(
+                since=self.state.last_modified):
+            if not self._is_our_dataset(dataset):
+                continue
+            last_modified = max(
+                last_modified, solr_date(dataset['metadata_modified']))
+            source_id = dataset['extras'][self.source_id_field_name]
+            if self.state.is_unchanged(source_id, dataset):
+                continue
+            if source_id in self.state.datasets:
+                dataset = self.client.get_dataset(dataset['id'])
+                modified_ids.add(source_id)
+            snapshot[source_id] = dataset
+
+        return snapshot, modified_ids, last_modified
+
     def _check_dataset(self, dataset, expected):
         """
         Check whether dataset is up to date with expected..
@@ -1039,21 +2849,27 @@ class CkanDataImportClient(object):
         # todo: we need to make sure we are getting group/org **ids**,
         #       not names
 
+        ## Note: we might get "slim" datasets here, with just
+        ## a few fields in them: they are simply reported as different.
+
         for field in DATASET_FIELDS['core']:
             if field in expected:
-                if dataset[field] != expected[field]:
+                if dataset.get(field) != expected[field]:
                     return False
 
         if 'extras' in expected:
-            if dataset['extras'] != expected['extras']:
+            if dataset.get('extras') != expected['extras']:
                 return False
 
         if 'groups' in expected:
-            if sorted(dataset['groups']) != sorted(expected['groups']):
+            if sorted(dataset.get('groups') or []) \
+                    != sorted(expected['groups']):
                 return False
 
         ## Check resources
         if 'resources' in expected:
+            if 'resources' not in dataset:
+                return False
             _dataset_resources = dict((x['url'], x)
                                       for x in dataset['resources'])
             _expected_resources = dict((x['url'], x)
@@ -1074,8 +2890,9 @@ class CkanDataImportClient(object):
                 _resource = _dataset_resources[key]
                 _expected = _expected_resources[key]
                 for field in RESOURCE_FIELDS['core']:
-                    if _resource[field] != _expected[field]:
-                        return False
+                    if field in _expected:
+                        if _resource.get(field) != _expected[field]:
+                            return False
 
         ## Need to check relationships (wtf is that, btw?)
 
@@ -1093,7 +2910,29 @@ class CkanDataImportClient(object):
         """
         return True
 
-    def _verify_datasets(self, datasets):
+    def _is_up_to_date(self, dataset, expected, deep_check=False):
+        """
+        Check whether a dataset in Ckan is up to date with the expected one.
+
+        If both have a fingerprint, they are just compared; otherwise
+        (or if ``deep_check`` is True) we fall back to comparing all
+        the fields with ``_check_dataset()``.
+        """
+        expected_hash = (expected.get('extras') or {}).get(
+            self.source_hash_field_name)
+        current_hash = (dataset.get('extras') or {}).get(
+            self.source_hash_field_name)
+
+        if expected_hash is not None and current_hash is not None:
+            if expected_hash != current_hash:
+                return False
+            if not deep_check:
+                return True
+
+        return self._check_dataset(dataset, expected)
+
+    def _verify_datasets(self, datasets, our_datasets=None, prepare=None,
+                         deep_check=False, force_check=()):
         """
         Compare differences between current state and desired state
         of the datasets collection.
@@ -1101,6 +2940,23 @@ class CkanDataImportClient(object):
         :param datasets:
             A dictionary (or dict-like) mapping {<source-id>: <dataset>}
 
+        :param our_datasets:
+            A snapshot of the datasets from this source currently in Ckan,
+            as returned by ``_get_our_datasets()``. If omitted, it will
+            be retrieved from Ckan. It won't be modified.
+
+        :param prepare:
+            Function used to convert datasets from the source
+            to the format expected in Ckan, before comparing them.
+
+        :param deep_check:
+            If True, always compare datasets field by field, even
+            if fingerprints match. See ``_is_up_to_date()``.
+
+        :param force_check:
+            Source ids of datasets to compare field by field anyway,
+            as if ``deep_check`` was True for them.
+
         :return: a dict with following keys:
             - missing:
                 List of IDPair of datasets that are in ``datasets`` but
@@ -1120,9 +2976,10 @@ class CkanDataImportClient(object):
 
         ## Dictionary mapping {<source_id>: <dataset>} for datasets in Ckan,
         ## filtered on source name.
-        our_datasets = dict(
-            (x['extras'][self.source_id_field_name], x)
-            for x in self._find_our_datasets())
+        if our_datasets is None:
+            our_datasets = self._get_our_datasets()
+        else:
+            our_datasets = dict(our_datasets)  # we're going to pop()
 
         # ## Create map of {'source_id': 'ckan_id'}
         # dataset_ids = ((k, v['id']) for k, v in our_datasets.iteritems())
@@ -1147,7 +3004,10 @@ class CkanDataImportClient(object):
                 _id_pair = IDPair(source_id=source_id,
                                   ckan_id=existing_dataset['id'])
 
-                if not self._check_dataset(existing_dataset, dataset):
+                expected = dataset if prepare is None else prepare(dataset)
+                _deep_check = deep_check or source_id in force_check
+                if not self._is_up_to_date(existing_dataset, expected,
+                                           deep_check=_deep_check):
                     ## This dataset differs from the one in the database
                     updated_datasets.append(_id_pair)
 
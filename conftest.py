@@ -4,12 +4,27 @@ import pytest
 
 
 @pytest.fixture(scope='session')
-def ckan_url():
+def fake_ckan_server():
+    """
+    In-process stand-in Ckan server, used by the functional tests
+    when no ``CKAN_BASE_URL`` is configured.
+    """
+    from tests.utils.fake_ckan import FakeCkanServer
+    with FakeCkanServer(api_key='fake-api-key') as server:
+        yield server
+
+
+@pytest.fixture(scope='session')
+def ckan_url(request):
+    if 'CKAN_BASE_URL' not in os.environ:
+        return request.getfixturevalue('fake_ckan_server').url
     return os.environ['CKAN_BASE_URL']
 
 
 @pytest.fixture(scope='session')
-def api_key():
+def api_key(request):
+    if 'CKAN_BASE_URL' not in os.environ:
+        return request.getfixturevalue('fake_ckan_server').app.api_key
     return os.environ['CKAN_API_KEY']
 
 
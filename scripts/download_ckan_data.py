@@ -1,13 +1,44 @@
 """
 Download data from a Ckan website to a given directory
+
+Objects are downloaded concurrently, and written to
+``<dest_dir>/<type>/<id>``. Interrupted downloads can be resumed
+by running the script again on the same directory.
+
+With ``--incremental``, an existing mirror is updated in place:
+only datasets modified since the last run are downloaded again,
+and objects deleted from Ckan are removed.
+
+With ``--archive``, objects are written to a compressed archive
+per type instead, see ``ArchiveWriter``.
 """
 
+import argparse
+import concurrent.futures
+import contextlib
 import json
 import os
 import sys
 import urlparse
+import zlib
 
 import requests
+import requests.adapters
+
+
+## Each type folder keeps a log of downloaded objects, as
+## JSON lines of [<key>, <file name>]: keys returned by the
+## list functions are not always the same as object ids.
+DOWNLOAD_LOG_NAME = '.downloaded'
+
+## Highest metadata_modified of datasets at the time of the last
+## incremental update, stored in the dataset folder
+HIGH_WATER_MARK_NAME = '.high_water_mark'
+
+## Archives are stored as <dest_dir>/<type>.jsonl.gz, with
+## an index in <dest_dir>/<type>.jsonl.gz.idx
+ARCHIVE_EXT = '.jsonl.gz'
+ARCHIVE_INDEX_EXT = '.idx'
 
 
 class HTTPError(Exception):
@@ -20,9 +51,16 @@ class HTTPError(Exception):
 
 
 class CkanReadClient(object):
-    def __init__(self, base_url):
+    def __init__(self, base_url, pool_maxsize=10):
         self.base_url = base_url
 
+        ## Shared by all the threads, keeping connections alive
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
     def request(self, method, path, **kwargs):
         headers = kwargs.get('headers') or {}
         kwargs['headers'] = headers
@@ -33,7 +71,7 @@ class CkanReadClient(object):
         path = path.strip('/')
 
         url = urlparse.urljoin(self.base_url, path)
-        response = requests.request(method, url, **kwargs)
+        response = self.session.request(method, url, **kwargs)
         if not response.ok:
             ## todo: attach message, if any available..
             raise HTTPError(response.status_code,
@@ -55,6 +93,15 @@ class CkanReadClient(object):
         response = self.request('GET', path)
         return response.json()
 
+    def search_datasets(self, fq=None, rows=None, start=None, sort=None,
+                        fl=None):
+        path = '/api/3/action/package_search'
+        params = {'q': '*:*', 'fq': fq, 'rows': rows, 'start': start,
+                  'sort': sort, 'fl': fl, 'include_private': 'true'}
+        response = self.request('GET', path, params=dict(
+            (k, v) for k, v in params.iteritems() if v is not None))
+        return response.json()['result']
+
     def list_groups(self):
         path = '/api/2/rest/group'
         response = self.request('GET', path)
@@ -99,49 +146,456 @@ class CkanReadClient(object):
         return response.json()
 
 
-if __name__ == '__main__':
-    try:
-        base_url = sys.argv[1]
-        dest_dir = sys.argv[2]
-    except IndexError:
-        print("Usage: download_ckan_data.py <base_url> <dest_dir>")
+def solr_date(value):
+    """
+    Convert a Ckan timestamp (eg. ``metadata_modified``) into
+    a date suitable for Solr queries (milliseconds precision, UTC).
+    """
+    if '.' in value:
+        base, fraction = value.split('.', 1)
+        value = '{0}.{1}'.format(base, fraction[:3])
+    return value.rstrip('Z') + 'Z'
+
+
+def get_last_modified(client):
+    """Get the highest metadata_modified of datasets in Ckan"""
+    result = client.search_datasets(
+        rows=1, sort='metadata_modified desc', fl='id metadata_modified')
+    if len(result['results']) == 0:
+        return None
+    return solr_date(result['results'][0]['metadata_modified'])
+
+
+def iter_modified_dataset_ids(client, since, page_size=1000):
+    """
+    Iterate ids of datasets modified since a given date, using
+    the last seen ``metadata_modified`` as a cursor: unlike offsets,
+    this cannot skip datasets if others get deleted meanwhile.
+    """
+    seen_ids = set()
+    while True:
+        result = client.search_datasets(
+            fq='metadata_modified:[{0} TO *]'.format(since),
+            rows=page_size, sort='metadata_modified asc, id asc',
+            fl='id metadata_modified')
+
+        new_ids = [x['id'] for x in result['results']
+                   if x['id'] not in seen_ids]
+        for dataset_id in new_ids:
+            seen_ids.add(dataset_id)
+            yield dataset_id
+
+        if len(result['results']) < page_size:
+            return
+        if len(new_ids) == 0:
+            raise ValueError(
+                "Too many datasets with metadata_modified={0}, "
+                "try increasing page_size".format(since))
+        since = solr_date(result['results'][-1]['metadata_modified'])
+
+
+def read_dataset_tags(folder, dataset_ids):
+    """Get the tags of datasets in the mirror"""
+    tags = set()
+    for dataset_id in dataset_ids:
+        path = os.path.join(folder, dataset_id)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                tags.update(json.load(f).get('tags') or [])
+    return tags
+
+
+def object_file_name(key, obj):
+    return obj['id']
+
+
+def tag_file_name(key, obj):
+    """Tags are returned as lists of dataset names, without an id"""
+    return key
+
+
+def write_file_atomic(path, data):
+    """Write a file via a temporary one, to never leave partial files"""
+    folder, name = os.path.split(path)
+    tmp_path = os.path.join(folder, '.{0}.tmp'.format(name))
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
+
+
+def read_download_log(folder):
+    """
+    Read the download log in a folder.
+
+    :return: a dict mapping {<key>: <file name>}, for objects
+        that are still on disk.
+    """
+    log_path = os.path.join(folder, DOWNLOAD_LOG_NAME)
+    if not os.path.exists(log_path):
+        return {}
+
+    downloaded = {}
+    with open(log_path, 'r') as f:
+        for line in f:
+            try:
+                key, name = json.loads(line)
+            except ValueError:
+                continue  # truncated line, after a crash
+            if os.path.exists(os.path.join(folder, name)):
+                downloaded[key] = name
+    return downloaded
+
+
+def download_objects(dest_dir, obj_type, keys, fetch, workers,
+                     get_name=None, refresh=()):
+    """
+    Download objects concurrently, skipping already downloaded ones.
+
+    :param dest_dir: destination directory
+    :param obj_type: object type, used as folder name
+    :param keys: keys of the objects to download
+    :param fetch: function called as ``fetch(key)`` to get an object
+    :param workers: number of threads to use
+    :param get_name:
+        function called as ``get_name(key, obj)`` to get the
+        file name. Defaults to the object id.
+    :param refresh:
+        keys of objects to download again, even if already on disk
+
+    :return: the number of failed downloads
+    """
+
+    if get_name is None:
+        get_name = object_file_name
+
+    folder = os.path.join(dest_dir, obj_type)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    downloaded = read_download_log(folder)
+    refresh = frozenset(refresh)
+    keys = [key for key in keys
+            if key not in downloaded or key in refresh]
+    print("\033[1;36mDownloading {0} {1}s ({2} already downloaded)\033[0m"
+          .format(len(keys), obj_type, len(downloaded)))
+
+    def _download(key):
+        obj = fetch(key)
+        name = get_name(key, obj)
+        write_file_atomic(os.path.join(folder, name), json.dumps(obj))
+        return name
+
+    failures = 0
+    log_path = os.path.join(folder, DOWNLOAD_LOG_NAME)
+    if os.path.exists(log_path) and os.path.getsize(log_path) > 0:
+        ## Terminate any line truncated by a crash: the first
+        ## new entry would be appended to it, and get lost
+        with open(log_path, 'rb+') as log:
+            log.seek(-1, os.SEEK_END)
+            if log.read(1) != '\n':
+                log.seek(0, os.SEEK_END)
+                log.write('\n')
+    with open(log_path, 'a') as log, \
+            concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = dict((executor.submit(_download, key), key)
+                       for key in keys)
+        for future in concurrent.futures.as_completed(futures):
+            key = futures[future]
+            try:
+                name = future.result()
+            except Exception as e:
+                failures += 1
+                print("\033[1;31mFailed downloading {0} {1}: {2}\033[0m"
+                      .format(obj_type, key, e))
+                continue
+            log.write(json.dumps([key, name]) + '\n')
+            log.flush()
+            print("\033[0;36mDownloaded object: {0}\033[0m".format(name))
+
+    return failures
+
+
+class ArchiveWriter(object):
+    """
+    Write objects to a compressed JSON lines archive.
+
+    The archive is a sequence of gzip members (so it can be read
+    as a whole by any gzip tool), each holding a block of objects,
+    one JSON per line. The index has a JSON line per block:
+    ``{"offset": .., "length": .., "keys": [..], "names": [..]}``,
+    where names are the object ids (or file names).
+
+    Blocks are appended, and indexed only after being written:
+    opening an existing archive resumes writing after the last
+    indexed block.
+    """
+
+    def __init__(self, path, block_size=100):
+        self.path = path
+        self.index_path = path + ARCHIVE_INDEX_EXT
+        self.block_size = block_size
+        self.keys = set()
+        self._block = []
+
+        index_lines = []
+        self._offset = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                for line in f:
+                    try:
+                        block = json.loads(line)
+                    except ValueError:
+                        break  # truncated line, after a crash
+                    index_lines.append(line)
+                    self.keys.update(block['keys'])
+                    self._offset = block['offset'] + block['length']
+
+        ## Drop anything not indexed, eg. a partially written block
+        self._file = open(path, 'ab')
+        self._file.truncate(self._offset)
+        write_file_atomic(self.index_path, ''.join(index_lines))
+        self._index = open(self.index_path, 'a')
+
+    def write(self, key, name, obj):
+        self._block.append((key, name, json.dumps(obj)))
+        if len(self._block) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if len(self._block) == 0:
+            return
+
+        compressor = zlib.compressobj(
+            6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip format
+        data = compressor.compress(
+            ''.join(x[2] + '\n' for x in self._block))
+        data += compressor.flush()
+        self._file.write(data)
+        self._file.flush()
+
+        self._index.write(json.dumps({
+            'offset': self._offset,
+            'length': len(data),
+            'keys': [x[0] for x in self._block],
+            'names': [x[1] for x in self._block],
+        }) + '\n')
+        self._index.flush()
+
+        self.keys.update(x[0] for x in self._block)
+        self._offset += len(data)
+        self._block = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        self._index.close()
+
+
+def iter_fetched(fetch, keys, workers):
+    """
+    Fetch objects concurrently, keeping a bounded number of them
+    in flight, to avoid holding the whole catalog in memory.
+
+    :return: an iterator of ``(key, obj, error)`` tuples,
+        in completion order.
+    """
+    keys = iter(keys)
+    pending = {}
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        while True:
+            for key in keys:
+                pending[executor.submit(fetch, key)] = key
+                if len(pending) >= workers * 2:
+                    break
+            if len(pending) == 0:
+                return
+
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    yield key, future.result(), None
+                except Exception as e:
+                    yield key, None, e
+
+
+def archive_objects(dest_dir, obj_type, keys, fetch, workers,
+                    get_name=None, block_size=100):
+    """
+    Download objects concurrently into an archive, skipping the
+    ones already in there. See ``download_objects()`` for arguments.
+
+    :return: the number of failed downloads
+    """
+
+    if get_name is None:
+        get_name = object_file_name
+
+    if not os.path.exists(dest_dir):
+        os.makedirs(dest_dir)
+
+    writer = ArchiveWriter(os.path.join(dest_dir, obj_type + ARCHIVE_EXT),
+                           block_size=block_size)
+    keys = [key for key in keys if key not in writer.keys]
+    print("\033[1;36mArchiving {0} {1}s ({2} already archived)\033[0m"
+          .format(len(keys), obj_type, len(writer.keys)))
+
+    failures = 0
+    with contextlib.closing(writer):
+        for key, obj, error in iter_fetched(fetch, keys, workers):
+            if error is not None:
+                failures += 1
+                print("\033[1;31mFailed downloading {0} {1}: {2}\033[0m"
+                      .format(obj_type, key, error))
+                continue
+            name = get_name(key, obj)
+            writer.write(key, name, obj)
+            print("\033[0;36mDownloaded object: {0}\033[0m".format(name))
+
+    return failures
+
+
+def prune_objects(dest_dir, obj_type, keys):
+    """
+    Remove downloaded objects whose key is not in ``keys`` anymore
+    """
+    folder = os.path.join(dest_dir, obj_type)
+    keys = frozenset(keys)
+    for key, name in read_download_log(folder).iteritems():
+        if key not in keys:
+            os.unlink(os.path.join(folder, name))
+            print("\033[0;33mRemoved object: {0}\033[0m".format(name))
+
+
+def download_all(client, dest_dir, workers, archive=False):
+    """
+    Download all the objects not already in the mirror
+
+    :param archive:
+        if True, write objects to archives, see ``archive_objects()``
+
+    :return: the number of failed downloads
+    """
+    sections = [
+        ('dataset', client.list_datasets, client.get_dataset, None),
+        ('group', client.list_groups, client.get_group, None),
+        ('organization', client.list_organizations,
+         client.get_organization, None),
+        ('tag', client.list_tags, client.get_tag, tag_file_name),
+    ]
+
+    download = archive_objects if archive else download_objects
+
+    failures = 0
+    for obj_type, list_objects, fetch, get_name in sections:
+        failures += download(
+            dest_dir, obj_type, list_objects(), fetch,
+            workers=workers, get_name=get_name)
+    return failures
+
+
+def update_mirror(client, dest_dir, workers):
+    """
+    Incrementally update a mirror.
+
+    Datasets are downloaded again only if their ``metadata_modified``
+    is newer than the high-water mark recorded by the last successful
+    run (all of them, if there is no high-water mark yet); groups and
+    organizations are always downloaded again, as they are few, while
+    tags are only refreshed if used by modified datasets. Deleted
+    objects are detected by comparing the lists returned by Ckan with
+    the downloaded ones.
+
+    :return: the number of failed downloads
+    """
+
+    dataset_folder = os.path.join(dest_dir, 'dataset')
+    hwm_path = os.path.join(dataset_folder, HIGH_WATER_MARK_NAME)
+    since = None
+    if os.path.exists(hwm_path):
+        with open(hwm_path, 'r') as f:
+            since = f.read().strip() or None
+
+    ## Taken before listing, so that datasets modified while
+    ## we're running will be picked up again next time.
+    last_modified = get_last_modified(client)
+
+    dataset_ids = client.list_datasets()
+    if since is None:
+        ## No high-water mark (eg. the mirror was not created
+        ## incrementally): we cannot tell which datasets are stale
+        modified_ids = list(dataset_ids)
+        print("\033[1;36mNo high-water mark, refreshing all {0} datasets"
+              "\033[0m".format(len(modified_ids)))
+    else:
+        modified_ids = list(iter_modified_dataset_ids(client, since))
+        print("\033[1;36m{0} datasets modified since {1}\033[0m"
+              .format(len(modified_ids), since))
+
+    ## Tags of modified / deleted datasets, both before
+    ## and after the update, need to be downloaded again
+    deleted_ids = set(read_download_log(dataset_folder)) - set(dataset_ids)
+    modified_tags = read_dataset_tags(
+        dataset_folder, modified_ids + list(deleted_ids))
+    failures = download_objects(
+        dest_dir, 'dataset', dataset_ids, client.get_dataset, workers,
+        refresh=modified_ids)
+    modified_tags.update(read_dataset_tags(dataset_folder, modified_ids))
+    prune_objects(dest_dir, 'dataset', dataset_ids)
+
+    for obj_type, list_objects, fetch in [
+            ('group', client.list_groups, client.get_group),
+            ('organization', client.list_organizations,
+             client.get_organization)]:
+        keys = list_objects()
+        failures += download_objects(
+            dest_dir, obj_type, keys, fetch, workers, refresh=keys)
+        prune_objects(dest_dir, obj_type, keys)
+
+    tags = client.list_tags()
+    failures += download_objects(
+        dest_dir, 'tag', tags, client.get_tag, workers,
+        get_name=tag_file_name, refresh=modified_tags)
+    prune_objects(dest_dir, 'tag', tags)
+
+    if failures == 0 and last_modified is not None:
+        write_file_atomic(hwm_path, last_modified)
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Download data from a Ckan website")
+    parser.add_argument('base_url')
+    parser.add_argument('dest_dir')
+    parser.add_argument('--workers', type=int, default=8,
+                        help="number of concurrent downloads")
+    parser.add_argument('--incremental', action='store_true',
+                        help="update an existing mirror in place, only "
+                        "downloading datasets modified since last run")
+    parser.add_argument('--archive', action='store_true',
+                        help="write objects to a compressed archive "
+                        "per type, instead of a file per object")
+    args = parser.parse_args()
+
+    if args.incremental and args.archive:
+        parser.error("--incremental is not supported with --archive")
+
+    client = CkanReadClient(args.base_url, pool_maxsize=args.workers)
+
+    if args.incremental:
+        failures = update_mirror(client, args.dest_dir, args.workers)
+    else:
+        failures = download_all(client, args.dest_dir, args.workers,
+                                archive=args.archive)
+
+    if failures > 0:
+        print("\033[1;31m{0} downloads failed, run again to resume\033[0m"
+              .format(failures))
         sys.exit(1)
 
-    client = CkanReadClient(base_url)
-
-    if os.path.exists(dest_dir):
-        raise ValueError("Destination directory already exists")
-
-    os.makedirs(dest_dir)
-    os.makedirs(os.path.join(dest_dir, 'dataset'))
-    os.makedirs(os.path.join(dest_dir, 'group'))
-    os.makedirs(os.path.join(dest_dir, 'organization'))
-    os.makedirs(os.path.join(dest_dir, 'tag'))
-
-    print("\033[1;36mDownloading datasets\033[0m")
-    for obj in client.iter_datasets():
-        print("\033[0;36mDownloaded object: {0}\033[0m".format(obj['id']))
-        destfile = os.path.join(dest_dir, 'dataset', obj['id'])
-        with open(destfile, 'w') as f:
-            f.write(json.dumps(obj))
-
-    print("\033[1;36mDownloading groups\033[0m")
-    for obj in client.iter_groups():
-        print("\033[0;36mDownloaded object: {0}\033[0m".format(obj['id']))
-        destfile = os.path.join(dest_dir, 'group', obj['id'])
-        with open(destfile, 'w') as f:
-            f.write(json.dumps(obj))
-
-    print("\033[1;36mDownloading organizations\033[0m")
-    for obj in client.iter_organizations():
-        print("\033[0;36mDownloaded object: {0}\033[0m".format(obj['id']))
-        destfile = os.path.join(dest_dir, 'organization', obj['id'])
-        with open(destfile, 'w') as f:
-            f.write(json.dumps(obj))
-
-    # print("\033[1;36mDownloading tags\033[0m")
-    # for obj in client.iter_tags():
-    #     print("\033[0;36mDownloaded object: {0}\033[0m".format(obj['id']))
-    #     destfile = os.path.join(dest_dir, 'tag', obj['id'])
-    #     with open(destfile, 'w') as f:
-    #         f.write(json.dumps(obj))
+
+if __name__ == '__main__':
+    main()
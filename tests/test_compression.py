@@ -0,0 +1,69 @@
+"""
+Tests for compression of request / response bodies, against
+a local dummy HTTP server.
+"""
+
+import gzip
+import json
+import StringIO
+
+import pytest
+
+from ckan_api_client import CkanClient
+from .utils.dummy_server import DummyHandler, dummy_server
+
+
+class GzipHandler(DummyHandler):
+    """
+    Echoes back the (decompressed) request body, compressed
+    if the client accepts gzip.
+    """
+
+    def do_PUT(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        self.server.received.append(
+            (self.headers.get('Content-Encoding'), len(body)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=StringIO.StringIO(body)).read()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO.StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(body)
+            body = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def gzip_server(request):
+    return dummy_server(request, GzipHandler, received=[])
+
+
+def test_compression(gzip_server):
+    client = CkanClient(gzip_server.url, compress_threshold=1024)
+    big = {'notes': 'Lorem ipsum dolor sit amet. ' * 1000}
+    small = {'notes': 'Lorem ipsum'}
+
+    response = client.request('PUT', '/api/2/rest/dataset/x', data=big)
+    assert json.loads(response.content) == big
+    response = client.request('PUT', '/api/2/rest/dataset/x', data=small)
+    assert json.loads(response.content) == small
+
+    ## Only the big request is compressed
+    assert gzip_server.received[0][0] == 'gzip'
+    assert gzip_server.received[0][1] < len(json.dumps(big))
+    assert gzip_server.received[1] == (None, len(json.dumps(small)))
+
+    metrics = client.metrics()
+    assert metrics['request_bytes'] \
+        == gzip_server.received[0][1] + gzip_server.received[1][1]
+    assert metrics['request_bytes_saved'] \
+        == len(json.dumps(big)) - gzip_server.received[0][1]
+    assert metrics['response_bytes_saved'] > 0
+    assert metrics['response_bytes'] < len(json.dumps(big))
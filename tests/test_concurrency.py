@@ -0,0 +1,96 @@
+"""
+Tests for concurrent access to the API (prefetching, async client).
+"""
+
+import pytest
+
+from ckan_api_client import CkanClient, FetchError
+
+
+def test_iter_datasets_prefetch(ckan_client):
+    serial = list(ckan_client.iter_datasets())
+
+    prefetched = list(ckan_client.iter_datasets(workers=4, prefetch=8))
+    assert [x['id'] for x in prefetched] == [x['id'] for x in serial]
+
+    unordered = list(ckan_client.iter_datasets(workers=4, ordered=False))
+    assert sorted(x['id'] for x in unordered) \
+        == sorted(x['id'] for x in serial)
+
+
+def test_iter_objects_fails_fast():
+    client = CkanClient('http://127.0.0.1:1')
+
+    def fetch(object_id):
+        if object_id == 7:
+            raise ValueError("Bad object")
+        return object_id
+
+    with pytest.raises(FetchError) as excinfo:
+        list(client._iter_objects(fetch, xrange(100), workers=4))
+    assert excinfo.value.object_id == 7
+    assert isinstance(excinfo.value.error, ValueError)
+
+    assert list(client._iter_objects(fetch, xrange(7), workers=4)) \
+        == range(7)
+
+
+def test_async_client(ckan_url, api_key, ckan_client):
+    from ckan_api_client import AsyncCkanClient
+
+    with AsyncCkanClient(ckan_url, api_key, max_concurrency=4) as client:
+        dataset_ids = client.list_datasets().result()
+        assert dataset_ids == ckan_client.list_datasets()
+
+        futures = [client.get_dataset(x) for x in dataset_ids[:20]]
+        datasets = [f.result() for f in futures]
+        assert [x['id'] for x in datasets] == dataset_ids[:20]
+
+        ## Iterators fetch on the same pool of workers
+        assert [x['id'] for x in client.iter_datasets()] == dataset_ids
+
+        result = client.search_datasets(rows=5).result()
+        assert len(result['results']) == min(5, len(dataset_ids))
+
+
+def test_async_client_methods():
+    import inspect
+    from ckan_api_client import AsyncCkanClient
+
+    def _public_methods(cls):
+        return set(name for name, _ in inspect.getmembers(
+            cls, inspect.ismethod) if not name.startswith('_'))
+
+    assert _public_methods(CkanClient) \
+        <= _public_methods(AsyncCkanClient)
+
+
+def test_adaptive_limiter():
+    from ckan_api_client import AdaptiveLimiter
+
+    limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=8)
+
+    ## Additive increase: roughly +1 for each window of requests
+    for _ in xrange(4):
+        limiter.release(limiter.acquire(), 0.01)
+    assert limiter.stats()['limit'] == 4
+    for _ in xrange(4):
+        limiter.release(limiter.acquire(), 0.01)
+    assert limiter.stats()['limit'] == 5
+
+    ## Multiplicative decrease, once per burst of failures
+    tokens = [limiter.acquire() for _ in xrange(5)]
+    assert limiter.stats()['in_flight'] == 5
+    for token in tokens:
+        limiter.release(token, 0.01, overloaded=True)
+    stats = limiter.stats()
+    assert stats['limit'] == 2
+    assert stats['in_flight'] == 0
+    assert stats['overloads'] == 5
+
+    ## Slow requests count as overload too
+    limiter.latency_target = 1.0
+    limiter.release(limiter.acquire(), 5.0)
+    assert limiter.stats()['limit'] == 1
+    limiter.release(limiter.acquire(), 5.0)
+    assert limiter.stats()['limit'] == 1  # minimum
@@ -0,0 +1,52 @@
+"""
+Tests for connection pooling / keep-alive, against a local dummy
+HTTP server counting the connections it accepts.
+"""
+
+import pytest
+
+from ckan_api_client import CkanClient
+from .utils.dummy_server import DummyHandler, dummy_server
+
+
+class KeepAliveHandler(DummyHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        return self.reply_json(200, ['a', 'b', 'c'])
+
+
+@pytest.fixture
+def server(request):
+    return dummy_server(request, KeepAliveHandler)
+
+
+def test_pool_stats_keep_alive(server):
+    client = CkanClient(server.url)
+    for _ in xrange(5):
+        assert client.list_datasets() == ['a', 'b', 'c']
+
+    stats = client.pool_stats()
+    assert server.connections == 1
+    assert stats['pools'] == 1
+    assert stats['requests'] == 5
+    assert stats['connections'] == 1
+    assert stats['reused'] == 4
+    assert stats['reuse_ratio'] == 0.8
+    assert stats['idle_sockets'] == 1
+
+
+def test_pool_stats_no_keep_alive(server):
+    client = CkanClient(server.url, keep_alive=False)
+    for _ in xrange(5):
+        assert client.list_datasets() == ['a', 'b', 'c']
+
+    ## urllib3 reuses the same connection object, reconnecting
+    ## its socket: this must not be counted as reuse.
+    stats = client.pool_stats()
+    assert server.connections == 5
+    assert stats['requests'] == 5
+    assert stats['connections'] == 5
+    assert stats['reused'] == 0
+    assert stats['reuse_ratio'] == 0.0
+    assert stats['idle_sockets'] == 0
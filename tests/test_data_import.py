@@ -0,0 +1,160 @@
+"""
+Tests for the CkanDataImportClient internals, not requiring
+a running Ckan instance.
+"""
+
+from collections import OrderedDict
+
+import pytest
+
+from ckan_api_client import (
+    CkanDataImportClient, IDPair, SyncState, dataset_fingerprint)
+
+
+def test_dataset_fingerprint():
+    dataset = {'name': 'dataset-1', 'extras': {'a': 'aa', 'b': 'bb'}}
+    reordered = OrderedDict([
+        ('extras', OrderedDict([('b', 'bb'), ('a', 'aa')])),
+        ('name', 'dataset-1'),
+    ])
+    assert dataset_fingerprint(dataset) == dataset_fingerprint(reordered)
+
+    changed = {'name': 'dataset-1', 'extras': {'a': 'aa', 'b': 'BB'}}
+    assert dataset_fingerprint(dataset) != dataset_fingerprint(changed)
+
+    with_hash = {'name': 'dataset-1',
+                 'extras': {'a': 'aa', 'b': 'bb', '_hash': 'xxx'}}
+    assert dataset_fingerprint(with_hash, '_hash') \
+        == dataset_fingerprint(dataset)
+    assert '_hash' in with_hash['extras']  # left untouched
+
+
+def test_is_up_to_date():
+    client = CkanDataImportClient('http://127.0.0.1:1', None, 'test-source')
+    hash_field = client.source_hash_field_name
+
+    expected = {'name': 'dataset-1', 'title': 'Dataset 1',
+                'extras': {hash_field: 'aaa'}}
+
+    ## Slim datasets are compared by fingerprint only
+    slim = {'id': 'ckan-id', 'extras': {hash_field: 'aaa'}}
+    assert client._is_up_to_date(slim, expected)
+    assert not client._is_up_to_date(slim, expected, deep_check=True)
+
+    slim['extras'][hash_field] = 'bbb'
+    assert not client._is_up_to_date(slim, expected)
+
+    ## Datasets without a fingerprint are compared field by field
+    full = {'id': 'ckan-id', 'name': 'dataset-1', 'title': 'Dataset 1',
+            'extras': {hash_field: 'aaa'}}
+    legacy = {'name': 'dataset-1', 'extras': {}}
+    assert client._is_up_to_date(full, expected, deep_check=True)
+    assert not client._is_up_to_date({'id': 'ckan-id', 'extras': {}},
+                                     expected)
+    assert client._is_up_to_date({'name': 'dataset-1', 'extras': {}},
+                                 legacy)
+
+
+def test_apply_operations_isolates_failures():
+    client = CkanDataImportClient('http://127.0.0.1:1', None, 'test-source')
+
+    def _ok(idpair):
+        return idpair.source_id
+
+    def _fail(idpair):
+        raise ValueError("Failed: {0}".format(idpair.source_id))
+
+    operations = []
+    for x in xrange(20):
+        idpair = IDPair(source_id='src-{0}'.format(x), ckan_id=None)
+        if x % 5 == 0:
+            operations.append(('update', idpair, _fail))
+        else:
+            operations.append(('create', idpair, _ok))
+
+    for workers in (None, 4):
+        results = list(client._apply_operations(
+            operations, workers=workers, concurrency={'update': 1}))
+        assert len(results) == 20
+
+        failed = [x for x in results if x[3] is not None]
+        assert sorted(x[1].source_id for x in failed) \
+            == ['src-0', 'src-10', 'src-15', 'src-5']
+        assert all(isinstance(x[3], ValueError) for x in failed)
+
+        succeeded = [x for x in results if x[3] is None]
+        assert all(x[2] == x[1].source_id for x in succeeded)
+
+
+def test_sync_state_round_trip(tmpdir):
+    path = str(tmpdir.join('state.json'))
+    state = SyncState(path, 'test-source')
+    assert state.datasets == {}
+    assert state.last_modified is None
+
+    datasets = {'src-1': {
+        'id': 'ckan-1', 'metadata_modified': '2014-05-12T10:11:12.123456',
+        'extras': {'_hash': 'aaa'}}}
+    state.update(datasets, '2014-05-12T10:11:12.123Z', '_hash')
+    state.save()
+
+    state = SyncState(path, 'test-source')
+    assert state.last_modified == '2014-05-12T10:11:12.123Z'
+    assert state.datasets == {'src-1': {
+        'ckan_id': 'ckan-1', 'hash': 'aaa',
+        'metadata_modified': '2014-05-12T10:11:12.123Z'}}
+    assert state.is_unchanged('src-1', {
+        'id': 'ckan-1', 'metadata_modified': '2014-05-12T10:11:12.123Z'})
+    assert not state.is_unchanged('src-1', {
+        'id': 'ckan-1', 'metadata_modified': '2014-05-13T00:00:00Z'})
+    assert not state.is_unchanged('src-2', {
+        'id': 'ckan-2', 'metadata_modified': '2014-05-12T10:11:12.123Z'})
+
+    ## State of another source is ignored
+    with pytest.warns(UserWarning):
+        assert SyncState(path, 'other-source').datasets == {}
+
+
+def test_get_changed_datasets(tmpdir):
+    path = str(tmpdir.join('state.json'))
+    client = CkanDataImportClient('http://127.0.0.1:1', None, 'test-source',
+                                  state_path=path)
+    extras_fields = (client.source_field_name, client.source_id_field_name,
+                     client.source_hash_field_name)
+
+    def _dataset(source_id, modified, hash_):
+        return {'id': 'ckan-{0}'.format(source_id),
+                'metadata_modified': modified,
+                'extras': dict(zip(extras_fields,
+                                   ('test-source', source_id, hash_)))}
+
+    client.state.update(dict(
+        (x, _dataset(x, '2014-01-01T00:00:00Z', 'hash-' + x))
+        for x in ('a', 'b', 'c')), '2014-01-01T00:00:00Z',
+        client.source_hash_field_name)
+
+    ## 'a' was only written by us, 'b' modified by somebody else,
+    ## 'd' created by another run that failed before saving state
+    scanned = [
+        _dataset('a', '2014-01-01T00:00:00Z', 'hash-a'),
+        _dataset('b', '2014-02-01T00:00:00Z', 'hash-b'),
+        _dataset('d', '2014-03-01T00:00:00Z', 'hash-d'),
+    ]
+    fetched = []
+
+    def _get_dataset(dataset_id):
+        fetched.append(dataset_id)
+        return dict(_dataset('b', '2014-02-01T00:00:00Z', 'hash-b'),
+                    title='Modified')
+
+    client._scan_slim_datasets = lambda since: iter(scanned)
+    client._scan_our_dataset_ids = lambda: iter(
+        ['ckan-a', 'ckan-b', 'ckan-c', 'ckan-d'])
+    client.client.get_dataset = _get_dataset
+
+    snapshot, modified_ids, last_modified = client._get_changed_datasets()
+    assert sorted(snapshot) == ['a', 'b', 'c', 'd']
+    assert snapshot['b']['title'] == 'Modified'
+    assert fetched == ['ckan-b']
+    assert modified_ids == set(['b'])
+    assert last_modified == '2014-03-01T00:00:00Z'
@@ -276,8 +276,7 @@ def test_updating_groups(request, ckan_client):
 
     # Let's try updating the dataset with empty groups
     updated = ckan_client.update_dataset(dataset_id, {'groups': []})
-    assert sorted(updated['groups']) \
-        == sorted(dataset['groups'])  # WTF? -- should be empty
+    assert updated['groups'] == []
 
     ## APPARENTLY, if we pass a subset of the datasets, the extra ones
     ## will just get deleted.
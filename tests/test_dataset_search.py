@@ -0,0 +1,51 @@
+"""
+Tests for bulk catalog scans via package_search
+"""
+
+from ckan_api_client import normalize_dataset, solr_date, DATASET_FIELDS
+from .utils import prepare_dataset
+
+
+def test_normalize_dataset():
+    dataset = normalize_dataset({
+        'id': 'dataset-id',
+        'extras': [{'key': 'a', 'value': 'aa'}, {'key': 'b', 'value': 'bb'}],
+        'groups': [{'id': 'group-1', 'name': 'Group 1'}],
+        'tags': [{'id': 'tag-id', 'name': 'tag-1'}],
+        'relationships_as_object': [],
+        'relationships_as_subject': [],
+    })
+    assert dataset == {
+        'id': 'dataset-id',
+        'extras': {'a': 'aa', 'b': 'bb'},
+        'groups': ['group-1'],
+        'tags': ['tag-1'],
+        'relationships': [],
+    }
+
+
+def test_solr_date():
+    assert solr_date('2014-02-03T10:20:30.123456') \
+        == '2014-02-03T10:20:30.123Z'
+    assert solr_date('2014-02-03T10:20:30') == '2014-02-03T10:20:30Z'
+
+
+def test_scan_datasets(request, ckan_client):
+    created = ckan_client.post_dataset(prepare_dataset(ckan_client))
+    request.addfinalizer(lambda: ckan_client.delete_dataset(created['id']))
+
+    scanned = dict((x['id'], x)
+                   for x in ckan_client.scan_datasets(page_size=10))
+    assert sorted(scanned) == sorted(ckan_client.list_datasets())
+
+    scanned_cursor = list(ckan_client.scan_datasets(page_size=10,
+                                                    cursor=True))
+    assert sorted(x['id'] for x in scanned_cursor) == sorted(scanned)
+
+    ## Datasets must be in the same format returned by get_dataset()
+    dataset = ckan_client.get_dataset(created['id'])
+    for field in DATASET_FIELDS['core']:
+        assert scanned[created['id']][field] == dataset[field]
+    assert scanned[created['id']]['extras'] == dataset['extras']
+    assert sorted(scanned[created['id']]['groups']) \
+        == sorted(dataset['groups'])
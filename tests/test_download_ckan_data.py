@@ -0,0 +1,127 @@
+"""
+Tests for the scripts/download_ckan_data.py mirroring script
+"""
+
+import imp
+import json
+import os
+
+from ckan_api_client import CkanClient
+from .utils.fake_ckan import FakeCkanServer
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+download_ckan_data = imp.load_source('download_ckan_data', os.path.join(
+    HERE, os.path.pardir, 'scripts', 'download_ckan_data.py'))
+
+
+def test_update_mirror(tmpdir):
+    mirror_dir = str(tmpdir.join('mirror'))
+    dataset_folder = os.path.join(mirror_dir, 'dataset')
+
+    def _read_dataset(dataset_id):
+        with open(os.path.join(dataset_folder, dataset_id), 'r') as f:
+            return json.load(f)
+
+    with FakeCkanServer() as server:
+        client = CkanClient(server.url)
+        read_client = download_ckan_data.CkanReadClient(server.url)
+        dataset = client.post_dataset({'name': 'dataset-1', 'url': 'a'})
+
+        ## Mirror created without --incremental: no high-water mark
+        assert download_ckan_data.download_all(
+            read_client, mirror_dir, workers=2) == 0
+
+        ## Stale datasets are refreshed anyway on the first update
+        client.put_dataset(dataset['id'], {'url': 'b'})
+        assert download_ckan_data.update_mirror(
+            read_client, mirror_dir, workers=2) == 0
+        assert _read_dataset(dataset['id'])['url'] == 'b'
+        assert os.path.exists(os.path.join(
+            dataset_folder, download_ckan_data.HIGH_WATER_MARK_NAME))
+
+        ## ..then, only modified ones
+        client.put_dataset(dataset['id'], {'url': 'c'})
+        assert download_ckan_data.update_mirror(
+            read_client, mirror_dir, workers=2) == 0
+        assert _read_dataset(dataset['id'])['url'] == 'c'
+
+
+def test_download_objects_resume(tmpdir):
+    dest_dir = str(tmpdir)
+    folder = os.path.join(dest_dir, 'dataset')
+    objects = dict(('key-{0}'.format(i), {'id': 'id-{0}'.format(i)})
+                   for i in xrange(8))
+    keys = sorted(objects)
+    failing = set(['key-3', 'key-5'])
+    fetched = []
+
+    def _fetch(key):
+        fetched.append(key)
+        if key in failing:
+            raise ValueError("Download interrupted")
+        return objects[key]
+
+    def _download(**kw):
+        del fetched[:]
+        return download_ckan_data.download_objects(
+            dest_dir, 'dataset', keys, _fetch, workers=2, **kw)
+
+    assert _download() == 2
+    assert sorted(fetched) == keys
+    assert sorted(os.listdir(folder)) == sorted(
+        [download_ckan_data.DOWNLOAD_LOG_NAME] +
+        ['id-{0}'.format(i) for i in (0, 1, 2, 4, 6, 7)])
+
+    ## Crash while logging, and a file lost meanwhile
+    with open(os.path.join(folder, download_ckan_data.DOWNLOAD_LOG_NAME),
+              'a') as f:
+        f.write('["key-3", "id-')
+    os.unlink(os.path.join(folder, 'id-1'))
+
+    ## Only the missing objects are downloaded again
+    failing.clear()
+    assert _download() == 0
+    assert sorted(fetched) == ['key-1', 'key-3', 'key-5']
+    for key in keys:
+        with open(os.path.join(folder, objects[key]['id'])) as f:
+            assert json.load(f) == objects[key]
+
+    assert _download() == 0
+    assert fetched == []
+
+    assert _download(refresh=['key-0']) == 0
+    assert fetched == ['key-0']
+
+
+def test_download_objects_atomic_writes(tmpdir, monkeypatch):
+    dest_dir = str(tmpdir)
+    folder = os.path.join(dest_dir, 'dataset')
+    objects = {'key-0': {'id': 'id-0', 'title': 'Original'}}
+
+    def _download(**kw):
+        return download_ckan_data.download_objects(
+            dest_dir, 'dataset', ['key-0'], objects.__getitem__,
+            workers=1, **kw)
+
+    def _read():
+        with open(os.path.join(folder, 'id-0')) as f:
+            return json.load(f)
+
+    assert _download() == 0
+
+    ## Interrupted before the temporary file is moved in place:
+    ## the previous version is left untouched
+    def _interrupted_rename(src, dst):
+        raise OSError("Interrupted")
+
+    objects['key-0'] = {'id': 'id-0', 'title': 'Changed'}
+    with monkeypatch.context() as m:
+        m.setattr(os, 'rename', _interrupted_rename)
+        assert _download(refresh=['key-0']) == 1
+    assert _read()['title'] == 'Original'
+
+    assert _download(refresh=['key-0']) == 0
+    assert _read()['title'] == 'Changed'
+    assert sorted(os.listdir(folder)) == [
+        download_ckan_data.DOWNLOAD_LOG_NAME, 'id-0']
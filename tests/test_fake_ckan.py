@@ -0,0 +1,170 @@
+"""
+Tests for the stand-in Ckan server, making sure it reproduces
+the (quirky) behavior of the real API
+"""
+
+import time
+
+import pytest
+
+from ckan_api_client import CkanClient, HTTPError
+from .utils.fake_ckan import FakeCkanServer
+
+
+@pytest.fixture(scope='module')
+def fake_server(request):
+    server = FakeCkanServer(api_key='secret')
+    server.start()
+    request.addfinalizer(server.stop)
+    return server
+
+
+@pytest.fixture
+def client(fake_server):
+    fake_server.app.reset()
+    fake_server.app.latency = 0
+    return CkanClient(fake_server.url, 'secret')
+
+
+def test_put_dataset_flushes_omitted_fields(client):
+    group = client.post_group({'name': 'group-1', 'title': 'Group 1'})
+    created = client.post_dataset({
+        'name': 'dataset-1', 'title': 'Dataset 1', 'url': 'http://a',
+        'extras': {'a': 'aa', 'b': 'bb'},
+        'groups': [group['id']],
+        'resources': [{'url': 'http://example.com/1.csv'}],
+        'tags': ['tag-1'],
+    })
+    assert created['resources'][0]['position'] == 0
+    assert created['resources'][0]['package_id'] == created['id']
+
+    updated = client.put_dataset(created['id'], {'title': 'New title'})
+    assert updated['title'] == 'New title'
+    assert updated['url'] == 'http://a'  # core fields are kept
+    assert updated['extras'] == {}
+    assert updated['groups'] == []
+    assert updated['resources'] == []
+    assert updated['tags'] == []
+    assert updated['metadata_modified'] > created['metadata_modified']
+    assert updated['revision_id'] != created['revision_id']
+
+
+def test_put_dataset_merges_extras(client):
+    created = client.post_dataset({
+        'name': 'dataset-1', 'extras': {'a': 'aa', 'b': 'bb'}})
+
+    updated = client.put_dataset(
+        created['id'], {'extras': {'a': None, 'c': 'cc'}})
+    assert updated['extras'] == {'b': 'bb', 'c': 'cc'}
+
+    updated = client.put_dataset(created['id'], {'extras': {}})
+    assert updated['extras'] == {'b': 'bb', 'c': 'cc'}
+
+
+def test_update_dataset_preserves_data(client):
+    group = client.post_group({'name': 'group-1'})
+    created = client.post_dataset({
+        'name': 'dataset-1', 'extras': {'a': 'aa'}, 'groups': [group['id']],
+        'resources': [{'url': 'http://example.com/1.csv'}]})
+    updated = client.update_dataset(created['id'], {'url': 'http://b'})
+    assert updated['url'] == 'http://b'
+    assert updated['extras'] == {'a': 'aa'}
+    assert updated['groups'] == [group['id']]
+    assert updated['resources'] == created['resources']
+
+
+def test_deleted_dataset(client, fake_server):
+    created = client.post_dataset({'name': 'dataset-1'})
+    client.delete_dataset(created['id'])
+
+    assert client.list_datasets() == []
+    assert client.get_dataset(created['id'])['state'] == 'deleted'
+
+    anonymous = CkanClient(fake_server.url)
+    with pytest.raises(HTTPError) as excinfo:
+        anonymous.get_dataset(created['id'])
+    assert excinfo.value.status_code == 403
+
+    ## The name of deleted datasets can be reused
+    recreated = client.post_dataset({'name': 'dataset-1'})
+    assert recreated['id'] != created['id']
+    assert client.get_dataset('dataset-1')['id'] == recreated['id']
+
+
+def test_name_conflict(client):
+    client.post_dataset({'name': 'dataset-1'})
+    with pytest.raises(HTTPError) as excinfo:
+        client.post_dataset({'name': 'dataset-1'})
+    assert excinfo.value.status_code == 409
+
+
+def test_write_requires_api_key(client, fake_server):
+    anonymous = CkanClient(fake_server.url)
+    with pytest.raises(HTTPError) as excinfo:
+        anonymous.post_dataset({'name': 'dataset-1'})
+    assert excinfo.value.status_code == 403
+
+
+def test_organizations(client):
+    org = client.post_organization({
+        'name': 'org-1', 'title': 'Org 1',
+        'extras': [{'key': 'a', 'value': 'aa'}]})
+    assert client.list_organizations() == ['org-1']
+
+    dataset = client.post_dataset({'name': 'dataset-1', 'owner_org': 'org-1'})
+    assert dataset['owner_org'] == org['id']
+
+    shown = client.get_organization('org-1')
+    assert shown['extras'] == [{'key': 'a', 'value': 'aa'}]
+    assert [x['id'] for x in shown['packages']] == [dataset['id']]
+
+    client.delete_organization(org['id'])
+    assert client.list_organizations() == []
+    assert client.get_dataset(dataset['id'])['owner_org'] is None
+
+
+def test_search_datasets(client):
+    for i in xrange(5):
+        client.post_dataset({
+            'name': 'dataset-{0}'.format(i),
+            'extras': {'source': 'Harvest Source {0}'.format(i % 2)}})
+
+    result = client.search_datasets(fq='extras_source:"source 1"')
+    assert result['count'] == 2
+    assert sorted(x['name'] for x in result['results']) \
+        == ['dataset-1', 'dataset-3']
+
+    result = client.search_datasets(
+        fq='-extras_source:"source 1"', sort='name desc', rows=2, start=1,
+        fl='name,metadata_modified')
+    assert result['count'] == 3
+    assert [x['name'] for x in result['results']] \
+        == ['dataset-2', 'dataset-0']
+    assert result['results'][0]['metadata_modified'].endswith('Z')
+
+    scanned = [x['name'] for x in client.scan_datasets(
+        page_size=2, cursor=True)]
+    assert sorted(scanned) == ['dataset-{0}'.format(i) for i in xrange(5)]
+
+
+def test_search_private_datasets(client):
+    client.post_dataset({'name': 'dataset-public'})
+    client.post_dataset({'name': 'dataset-private', 'private': True})
+
+    ## Ckan only returns private datasets if explicitly requested
+    result = client.search_datasets(include_private=False)
+    assert [x['name'] for x in result['results']] == ['dataset-public']
+
+    result = client.search_datasets()
+    assert sorted(x['name'] for x in result['results']) \
+        == ['dataset-private', 'dataset-public']
+
+    scanned = [x['name'] for x in client.scan_datasets(cursor=True)]
+    assert sorted(scanned) == ['dataset-private', 'dataset-public']
+
+
+def test_latency(client, fake_server):
+    fake_server.app.latency = 0.1
+    start = time.time()
+    client.list_datasets()
+    assert time.time() - start >= 0.1
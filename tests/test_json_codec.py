@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the pluggable JSON codec
+"""
+
+import json
+
+import pytest
+
+from ckan_api_client import JsonCodec, JSON_BACKENDS, canonical_json
+
+
+def _available_backends():
+    backends = []
+    for name in JSON_BACKENDS:
+        try:
+            backends.append(JsonCodec(name))
+        except ImportError:
+            pass
+    return backends
+
+
+@pytest.mark.parametrize('codec', _available_backends(),
+                         ids=lambda codec: codec.name)
+def test_json_codec_roundtrip(codec):
+    obj = {u'name': u'dataset-1', u'title': u'Dàtaset 1',
+           u'extras': {u'a': u'aa', u'b': None},
+           u'resources': [{u'position': 0, u'size': 1234}],
+           u'private': False}
+    assert codec.loads(codec.dumps(obj)) == obj
+    assert json.loads(codec.dumps(obj)) == obj
+
+
+def test_json_codec_default():
+    assert JsonCodec().name in JSON_BACKENDS
+    assert JsonCodec(json).name == 'json'
+
+
+def test_canonical_json():
+    assert canonical_json({u'b': [1, 2], u'a': u'à'}) \
+        == '{"a":"\\u00e0","b":[1,2]}'
@@ -0,0 +1,128 @@
+"""
+Tests for the retry policy, against a local dummy HTTP server.
+"""
+
+import json
+import threading
+
+import pytest
+
+from ckan_api_client import CkanClient, HTTPError, RetryPolicy
+from .utils.dummy_server import DummyHandler, dummy_server
+
+
+class FlakyHandler(DummyHandler):
+    """
+    Fails the first ``server.failures`` requests with 503.
+    POSTs to /api/2/rest/dataset are "lost": the dataset is
+    created (unless the name is taken) but the response is
+    a 502 anyway.
+    """
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path))
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            return self.reply_json(503)
+        if self.path.startswith('/api/2/rest/dataset/'):
+            name = self.path.rsplit('/', 1)[-1]
+            if name not in self.server.datasets:
+                return self.reply_json(404)
+            return self.reply_json(200, self.server.datasets[name])
+        return self.reply_json(200, ['a', 'b', 'c'])
+
+    def do_POST(self):
+        self.server.requests.append(('POST', self.path))
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length))
+        data.update({'id': 'id-' + data['name'], 'state': 'active'})
+        self.server.datasets.setdefault(data['name'], data)
+        return self.reply_json(502)
+
+
+@pytest.fixture
+def flaky_server(request):
+    return dummy_server(request, FlakyHandler, failures=0, requests=[],
+                        datasets={})
+
+
+@pytest.fixture
+def flaky_client(flaky_server):
+    policy = RetryPolicy(max_retries=3, backoff_factor=0.01)
+    return CkanClient(flaky_server.url, retry_policy=policy)
+
+
+def test_retry_idempotent_requests(flaky_server, flaky_client):
+    flaky_server.failures = 2
+    assert flaky_client.list_datasets() == ['a', 'b', 'c']
+    assert len(flaky_server.requests) == 3
+
+    metrics = flaky_client.metrics()
+    assert metrics['retries'] == 2
+    assert metrics['retried_requests'] == 1
+    assert metrics['retry_failures'] == 0
+    assert metrics['retry_time'] > 0
+
+    ## Give up after max_retries
+    flaky_server.failures = 10
+    with pytest.raises(HTTPError) as excinfo:
+        flaky_client.list_datasets()
+    assert excinfo.value.status_code == 503
+    assert flaky_client.metrics()['retries'] == 5
+    assert flaky_client.metrics()['retry_failures'] == 1
+
+
+def test_no_retry_when_disabled(flaky_server):
+    client = CkanClient(flaky_server.url, retry_policy=False)
+    flaky_server.failures = 1
+    with pytest.raises(HTTPError):
+        client.list_datasets()
+    assert client.metrics()['retries'] == 0
+
+
+def test_create_is_looked_up_before_retrying(flaky_server, flaky_client):
+    created = flaky_client.post_dataset({'name': 'dataset-1'})
+    assert created['id'] == 'id-dataset-1'
+
+    ## The dataset was created by the first request: no more POSTs
+    assert flaky_server.requests == [
+        ('POST', '/api/2/rest/dataset'),
+        ('GET', '/api/2/rest/dataset/dataset-1'),
+    ]
+    assert flaky_client.metrics()['retried_requests'] == 1
+
+
+def test_create_ignores_other_objects_with_same_name(flaky_server,
+                                                     flaky_client):
+    flaky_server.datasets['dataset-1'] = {
+        'id': 'other-id', 'name': 'dataset-1', 'state': 'active',
+        'extras': {'source': 'other-source'}}
+
+    with pytest.raises(HTTPError) as excinfo:
+        flaky_client.post_dataset({
+            'name': 'dataset-1', 'extras': {'source': 'our-source'}})
+    assert excinfo.value.status_code == 502
+    assert flaky_server.requests == [
+        ('POST', '/api/2/rest/dataset'),
+        ('GET', '/api/2/rest/dataset/dataset-1'),
+    ]
+    assert flaky_client.metrics()['retry_failures'] == 1
+
+
+def test_failed_streamed_responses_are_released(flaky_server):
+    ## With a single, blocking, connection slot, a leaked
+    ## connection would block the retry forever
+    client = CkanClient(
+        flaky_server.url, pool_maxsize=1, pool_block=True,
+        retry_policy=RetryPolicy(max_retries=3, backoff_factor=0.01))
+    flaky_server.failures = 2
+
+    result = []
+    thread = threading.Thread(
+        target=lambda: result.extend(client.iter_dataset_ids()))
+    thread.daemon = True
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert result == ['a', 'b', 'c']
+    assert client.metrics()['retries'] == 2
@@ -3,11 +3,12 @@ Test some simple harvesting scenarios
 """
 
 import os
+import threading
 
 import pytest
 
-from ckan_api_client import CkanDataImportClient
-from .utils.harvest_source import HarvestSource
+from ckan_api_client import CkanDataImportClient, SomethingWentWrong
+from .utils.harvest_source import HarvestSource, harvest_source_delta
 
 
 HERE = os.path.abspath(os.path.dirname(__file__))
@@ -24,3 +25,173 @@ def harvest_source(request):
 def test_real_harvesting_scenario(ckan_url, api_key, harvest_source):
     client = CkanDataImportClient(ckan_url, api_key, 'test-source')
     client.sync_data(harvest_source, double_check=True)
+
+
+def test_sync_state_recreates_deleted_datasets(ckan_url, api_key, tmpdir):
+    state_path = str(tmpdir.join('state.json'))
+    harvest_source = HarvestSource(DATA_DIR, 'day-00')
+    client = CkanDataImportClient(ckan_url, api_key, 'test-source-state',
+                                  state_path=state_path)
+    result = client.sync_data(harvest_source, double_check=True)
+    assert len(result['created']) == len(harvest_source['dataset'])
+    idpair = result['created'][0]
+
+    ## Second run, to get a high-water mark in the state
+    client.sync_data(harvest_source, double_check=True)
+    assert client.state.last_modified is not None
+
+    ## Somebody else deletes one of our datasets
+    client.client.delete_dataset(idpair.ckan_id)
+
+    client = CkanDataImportClient(ckan_url, api_key, 'test-source-state',
+                                  state_path=state_path)
+    result = client.sync_data(harvest_source, double_check=True)
+    assert [x.source_id for x in result['created']] == [idpair.source_id]
+    assert result['updated'] == []
+
+    ## Cleanup
+    client.sync_data({'dataset': {}, 'group': {}, 'organization': {}})
+
+
+def test_sync_deep_check(ckan_url, api_key):
+    harvest_source = HarvestSource(DATA_DIR, 'day-00')
+    client = CkanDataImportClient(ckan_url, api_key, 'test-source-deep')
+    result = client.sync_data(harvest_source, deep_check=True)
+    assert len(result['created']) == len(harvest_source['dataset'])
+
+    ## Cached source records are shared: make sure they're untouched
+    delta = harvest_source_delta(
+        HarvestSource(DATA_DIR, 'day-00', cache_size=0), harvest_source)
+    assert all(x['changed'] == [] for x in delta.itervalues())
+
+    result = client.sync_data(harvest_source, deep_check=True)
+    assert result['created'] == result['updated'] == []
+
+    ## Somebody else changes a resource: fingerprints still match
+    ckan_id = client._get_our_datasets(slim=True).values()[0]['id']
+    dataset = client.client.get_dataset(ckan_id)
+    dataset['resources'][0]['format'] = 'Modified'
+    client.client.put_dataset(ckan_id, dataset)
+
+    result = client.sync_data(harvest_source, deep_check=True)
+    assert [x.ckan_id for x in result['updated']] == [ckan_id]
+
+    ## Cleanup
+    client.sync_data({'dataset': {}, 'group': {}, 'organization': {}})
+
+
+def test_sync_failures_are_reported(ckan_url, api_key):
+    harvest_source = HarvestSource(DATA_DIR, 'day-00')
+    client = CkanDataImportClient(ckan_url, api_key, 'test-source-failed')
+
+    ## Somebody else took the name of one of our datasets
+    source_id = sorted(harvest_source['dataset'])[0]
+    other = client.client.post_dataset({
+        'name': harvest_source['dataset'][source_id]['name']})
+
+    with pytest.raises(SomethingWentWrong) as excinfo:
+        client.sync_data(harvest_source)
+    result = excinfo.value.result
+    assert [(x[0], x[1].source_id) for x in result['failed']] \
+        == [('create', source_id)]
+    assert len(result['created']) == len(harvest_source['dataset']) - 1
+
+    ## Cleanup
+    client.client.delete_dataset(other['id'])
+    client.sync_data({'dataset': {}, 'group': {}, 'organization': {}})
+
+
+def test_sync_double_check_is_concurrent(ckan_url, api_key):
+    harvest_source = HarvestSource(DATA_DIR, 'day-00')
+    client = CkanDataImportClient(ckan_url, api_key, 'test-source-double')
+
+    get_dataset = client.client.get_dataset
+    fetched = []
+
+    def _get_dataset(dataset_id):
+        fetched.append((dataset_id, threading.current_thread().ident))
+        return get_dataset(dataset_id)
+
+    client.client.get_dataset = _get_dataset
+    result = client.sync_data(harvest_source, double_check=True, workers=4)
+
+    assert sorted(x[0] for x in fetched) \
+        == sorted(x.ckan_id for x in result['created'])
+    assert len(set(x[1] for x in fetched)) > 1
+
+    ## Cleanup
+    client.sync_data({'dataset': {}, 'group': {}, 'organization': {}})
+
+
+def test_sync_removed_extras_and_changed_groups(ckan_url, api_key):
+    client = CkanDataImportClient(ckan_url, api_key, 'test-source-groups')
+
+    def _source(extras, group_names):
+        return {
+            'group': {
+                'test-sync-g1': {'title': 'Group 1'},
+                'test-sync-g2': {'title': 'Group 2'},
+            },
+            'organization': {},
+            'dataset': {
+                'dataset-1': {
+                    'id': 'dataset-1', 'name': 'test-sync-dataset-1',
+                    'extras': extras, 'group_names': group_names,
+                },
+            },
+        }
+
+    result = client.sync_data(_source({'a': 'aa', 'b': 'bb'},
+                                       ['test-sync-g1']))
+    ckan_id = result['created'][0].ckan_id
+    g2_id = client.client.get_group('test-sync-g2')['id']
+
+    result = client.sync_data(_source({'a': 'aa'}, ['test-sync-g2']))
+    assert [x.ckan_id for x in result['updated']] == [ckan_id]
+
+    dataset = client.client.get_dataset(ckan_id)
+    assert 'b' not in dataset['extras']
+    assert dataset['groups'] == [g2_id]
+
+    ## Nothing left to fix, even when comparing field by field
+    result = client.sync_data(_source({'a': 'aa'}, ['test-sync-g2']),
+                              deep_check=True)
+    assert result['updated'] == []
+
+    ## Cleanup
+    client.sync_data({'dataset': {}, 'group': {}, 'organization': {}})
+    for name in ('test-sync-g1', 'test-sync-g2'):
+        client.client.delete_group(name)
+
+
+def test_search_only_returns_our_datasets(ckan_url, api_key):
+    clients = dict(
+        (name, CkanDataImportClient(ckan_url, api_key, name))
+        for name in ('test-source-alpha', 'test-source-beta'))
+
+    ckan_ids = {}
+    for name, client in clients.iteritems():
+        result = client.sync_data({
+            'group': {}, 'organization': {},
+            'dataset': dict(
+                ('dataset-{0}'.format(i), {
+                    'id': 'dataset-{0}'.format(i),
+                    'name': '{0}-dataset-{1}'.format(name, i),
+                }) for i in xrange(3)),
+        })
+        ckan_ids[name] = set(x.ckan_id for x in result['created'])
+        assert len(ckan_ids[name]) == 3
+
+    ## The server-side filter alone must exclude the other source
+    ## datasets, without relying on the _is_our_dataset() check
+    for name, client in clients.iteritems():
+        result = client.client.search_datasets(
+            fq=client._our_datasets_query(), fl='id', rows=1000)
+        assert set(x['id'] for x in result['results']) == ckan_ids[name]
+        assert set(client._scan_our_dataset_ids()) == ckan_ids[name]
+        assert set(x['id'] for x in client._find_our_datasets(slim=True)) \
+            == ckan_ids[name]
+
+    ## Cleanup
+    for client in clients.itervalues():
+        client.sync_data({'dataset': {}, 'group': {}, 'organization': {}})
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for streaming decoding of (large) list responses
+"""
+
+import json
+
+import pytest
+
+from ckan_api_client import iter_json_list
+
+
+def _split(data, size):
+    return [data[i:i + size] for i in xrange(0, len(data), size)]
+
+
+def test_iter_json_list():
+    items = [u'dataset-1', u'dàtaset-2', 123, 4.5, 1e10, [1, 2],
+             {u'a': u'b'}, True, None, u'x' * 100]
+    data = json.dumps(items, ensure_ascii=False).encode('utf-8')
+
+    ## Whatever the chunk size, we must get the same items
+    for size in xrange(1, 20):
+        assert list(iter_json_list(_split(data, size))) == items
+
+    assert list(iter_json_list(['[]'])) == []
+    assert list(iter_json_list([' [ 1 ,', ' 2 ] '])) == [1, 2]
+    assert list(iter_json_list(['[1', '2]'])) == [12]
+
+
+@pytest.mark.parametrize('data', ['', '{}', '[1,', '[1', '[1 2]'])
+def test_iter_json_list_invalid(data):
+    with pytest.raises(ValueError):
+        list(iter_json_list(_split(data, 1)))
+
+
+def test_streaming_lists(ckan_client):
+    assert list(ckan_client.iter_dataset_ids()) \
+        == ckan_client.list_datasets()
+    assert list(ckan_client.iter_group_ids()) == ckan_client.list_groups()
+    assert list(ckan_client.iter_tag_ids()) == ckan_client.list_tags()
+
+    assert [x['id'] for x in ckan_client.iter_datasets(stream=True)] \
+        == ckan_client.list_datasets()
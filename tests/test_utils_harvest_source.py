@@ -47,3 +47,251 @@ def test_utils_harvest_source():
         group_count += 1
     assert len(hs['group']) == group_count
     assert group_count > 0
+
+
+def test_utils_harvest_source_index(tmpdir):
+    import os
+    from .utils.harvest_source import HarvestSource
+
+    folder = tmpdir.mkdir('day-00').mkdir('dataset')
+    folder.join('dataset-1').write('{"title": "Dataset 1"}')
+
+    hs = HarvestSource(str(tmpdir), 'day-00')
+    assert list(hs) == ['dataset']
+    assert hs['dataset'] is hs['dataset']
+    assert list(hs['dataset']) == ['dataset-1']
+    assert hs['dataset']['dataset-1'] == {
+        'id': 'dataset-1', 'title': 'Dataset 1'}
+
+    ## The index is refreshed when the directory changes
+    folder.join('dataset-2').write('{"title": "Dataset 2"}')
+    folder.join('.hidden').write('{}')
+    os.utime(str(folder), (0, 12345))
+    assert sorted(hs['dataset']) == ['dataset-1', 'dataset-2']
+    assert len(hs['dataset']) == 2
+    assert 'dataset-2' in hs['dataset']
+    assert '.hidden' not in hs['dataset']
+
+
+def test_utils_packed_harvest_source(tmpdir):
+    import os
+    from .utils.harvest_source import (
+        HarvestSource, PackedHarvestSource, pack_harvest_source)
+
+    here = os.path.abspath(os.path.dirname(__file__))
+    data_path = os.path.join(here, os.path.pardir, 'data', 'datitrentino')
+    data_path = os.path.realpath(data_path)
+
+    hs = HarvestSource(data_path, 'day-00')
+    pack_path = str(tmpdir.join('day-00.pack'))
+    pack_harvest_source(hs, pack_path)
+
+    with PackedHarvestSource(pack_path) as packed:
+        assert sorted(packed) == sorted(hs)
+        for obj_type in hs:
+            assert obj_type in packed
+            assert sorted(packed[obj_type]) == sorted(hs[obj_type])
+            assert len(packed[obj_type]) == len(hs[obj_type])
+            for obj_id in hs[obj_type]:
+                assert packed[obj_type][obj_id] == hs[obj_type][obj_id]
+        assert 'no-such-id' not in packed['dataset']
+
+
+def test_utils_harvest_source_delta():
+    from .utils.harvest_source import harvest_source_delta
+
+    old = {
+        'dataset': {
+            'a': {'id': 'a', 'title': 'A'},
+            'b': {'id': 'b', 'title': 'B'},
+            'c': {'id': 'c', 'title': 'C'},
+        },
+        'group': {'g': {'id': 'g'}},
+    }
+    new = {
+        'dataset': {
+            'a': {'title': 'A', 'id': 'a'},
+            'b': {'id': 'b', 'title': 'B (changed)'},
+            'd': {'id': 'd', 'title': 'D'},
+        },
+        'organization': {'o': {'id': 'o'}},
+    }
+
+    assert harvest_source_delta(old, new) == {
+        'dataset': {'created': ['d'], 'changed': ['b'], 'removed': ['c']},
+        'group': {'created': [], 'changed': [], 'removed': ['g']},
+        'organization': {'created': ['o'], 'changed': [], 'removed': []},
+    }
+    assert harvest_source_delta(old, old, ['dataset']) == {
+        'dataset': {'created': [], 'changed': [], 'removed': []},
+    }
+
+
+def test_utils_harvest_source_delta_days():
+    import os
+    from .utils.harvest_source import HarvestSource, harvest_source_delta
+
+    here = os.path.abspath(os.path.dirname(__file__))
+    data_path = os.path.join(here, os.path.pardir, 'data', 'random')
+    data_path = os.path.realpath(data_path)
+
+    day0 = HarvestSource(data_path, 'day-00')
+    day1 = HarvestSource(data_path, 'day-01')
+    delta = harvest_source_delta(day0, day1)['dataset']
+
+    assert set(delta['created']) == set(day1['dataset']) - set(day0['dataset'])
+    assert set(delta['removed']) == set(day0['dataset']) - set(day1['dataset'])
+    for obj_id in delta['changed']:
+        assert day0['dataset'][obj_id] != day1['dataset'][obj_id]
+
+
+def test_utils_harvest_source_cache():
+    import os
+    from .utils.harvest_source import HarvestSource
+
+    here = os.path.abspath(os.path.dirname(__file__))
+    data_path = os.path.join(here, os.path.pardir, 'data', 'random')
+    data_path = os.path.realpath(data_path)
+
+    hs = HarvestSource(data_path, 'day-00', cache_size=2)
+    ids = sorted(hs['dataset'])[:3]
+
+    first = hs['dataset'][ids[0]]
+    assert hs.cache.stats() == {'size': 1, 'hits': 0, 'misses': 1}
+
+    ## Cached records are shared, not copied
+    assert hs['dataset'][ids[0]] is first
+    assert hs.cache.stats() == {'size': 1, 'hits': 1, 'misses': 1}
+
+    ## Least recently used records are evicted
+    hs['dataset'][ids[1]]
+    hs['dataset'][ids[2]]
+    assert hs.cache.stats() == {'size': 2, 'hits': 1, 'misses': 3}
+    hs['dataset'][ids[0]]
+    assert hs.cache.stats() == {'size': 2, 'hits': 1, 'misses': 4}
+    hs['dataset'][ids[2]]
+    assert hs.cache.stats() == {'size': 2, 'hits': 2, 'misses': 4}
+
+    ## Caching can be disabled
+    hs = HarvestSource(data_path, 'day-00', cache_size=0)
+    hs['dataset'][ids[0]]
+    hs['dataset'][ids[0]]
+    assert hs.cache.stats() == {'size': 0, 'hits': 0, 'misses': 2}
+
+
+def test_utils_harvest_source_bulk_load():
+    import os
+    from .utils.harvest_source import HarvestSource
+
+    here = os.path.abspath(os.path.dirname(__file__))
+    data_path = os.path.join(here, os.path.pardir, 'data', 'random')
+    data_path = os.path.realpath(data_path)
+
+    hs = HarvestSource(data_path, 'day-00')
+    collection = hs['dataset']
+    expected = dict((x, collection[x]) for x in collection)
+
+    for processes in (1, 2):
+        items = list(collection.iter_items(processes=processes, chunksize=3))
+        assert [x[0] for x in items] == list(collection)
+        assert dict(items) == expected
+
+    assert collection.load_all(processes=2) == expected
+
+
+def test_utils_archive_harvest_source(tmpdir):
+    import gzip
+    import imp
+    import json
+    import os
+    from .utils.harvest_source import ArchiveHarvestSource, HarvestSource
+
+    here = os.path.abspath(os.path.dirname(__file__))
+    script_path = os.path.join(
+        here, os.path.pardir, 'scripts', 'download_ckan_data.py')
+    download_ckan_data = imp.load_source('download_ckan_data', script_path)
+
+    data_path = os.path.join(here, os.path.pardir, 'data', 'random')
+    data_path = os.path.realpath(data_path)
+    hs = HarvestSource(data_path, 'day-00')
+
+    archive_dir = str(tmpdir.join('archive'))
+    for obj_type in hs:
+        collection = hs[obj_type]
+        ids = sorted(collection)
+
+        ## Write the first objects, then resume after a crash
+        ## that left a partially written block behind
+        failures = download_ckan_data.archive_objects(
+            archive_dir, obj_type, ids[:4], collection.__getitem__,
+            workers=2, block_size=3)
+        assert failures == 0
+        with open(os.path.join(archive_dir, obj_type + '.jsonl.gz'),
+                  'ab') as f:
+            f.write('garbage')
+
+        failures = download_ckan_data.archive_objects(
+            archive_dir, obj_type, ids, collection.__getitem__,
+            workers=2, block_size=3)
+        assert failures == 0
+
+        ## Archives are plain gzip files
+        with gzip.open(os.path.join(archive_dir, obj_type + '.jsonl.gz'),
+                       'rb') as f:
+            lines = f.read().splitlines()
+        assert sorted(json.loads(x)['id'] for x in lines) == ids
+
+    with ArchiveHarvestSource(archive_dir) as archive:
+        assert sorted(archive) == sorted(hs)
+        for obj_type in hs:
+            assert sorted(archive[obj_type]) == sorted(hs[obj_type])
+            for obj_id in hs[obj_type]:
+                assert archive[obj_type][obj_id] == hs[obj_type][obj_id]
+
+
+def test_utils_snapshot_store(tmpdir):
+    import os
+    from .utils.harvest_source import HarvestSource, harvest_source_delta
+    from .utils.snapshot_store import SnapshotStore
+
+    here = os.path.abspath(os.path.dirname(__file__))
+    data_path = os.path.join(here, os.path.pardir, 'data', 'datitrentino')
+    data_path = os.path.realpath(data_path)
+
+    store = SnapshotStore(str(tmpdir.join('store')))
+    days = ['day-00', 'day-01']
+    sources = dict((x, HarvestSource(data_path, x)) for x in days)
+    for day in days:
+        store.import_source(sources[day], day)
+    assert store.days() == days
+
+    ## Unchanged records are stored only once
+    objects = set()
+    for folder in os.listdir(store.objects_dir):
+        objects.update(os.listdir(os.path.join(store.objects_dir, folder)))
+    records = sum(len(sources[day][t]) for day in days for t in sources[day])
+    assert len(objects) < records
+
+    for day in days:
+        snapshot = store[day]
+        assert sorted(snapshot) == sorted(sources[day])
+        for obj_type in snapshot:
+            collection = sources[day][obj_type]
+            assert sorted(snapshot[obj_type]) == sorted(collection)
+            for obj_id in collection:
+                assert snapshot[obj_type][obj_id] == collection[obj_id]
+
+    ## Days can be compared by manifests alone
+    assert store.diff('day-00', 'day-01') \
+        == harvest_source_delta(sources['day-00'], sources['day-01'])
+
+    ## Only objects not referenced by other days are removed
+    store.remove_day('day-01')
+    assert store.days() == ['day-00']
+    assert store.collect_garbage() == len(objects) - sum(
+        len(sources['day-00'][x]) for x in sources['day-00'])
+    snapshot = store['day-00']
+    for obj_id in snapshot['dataset']:
+        assert snapshot['dataset'][obj_id] \
+            == sources['day-00']['dataset'][obj_id]
+
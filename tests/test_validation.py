@@ -0,0 +1,85 @@
+"""
+Tests for the argument / return value validators
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import ckan_api_client
+from ckan_api_client import (
+    check_arg_types, check_retval, is_dict_of, is_list_of)
+
+
+def test_stacked_validators():
+    calls = []
+
+    def func(self, value, flag=False):
+        calls.append(value)
+        return value
+
+    checked = check_arg_types(None, basestring, flag=bool)(
+        check_retval(is_list_of(basestring))(func))
+
+    ## Only one wrapper around the original function
+    assert checked._validation[0] is func
+
+    with pytest.raises(TypeError):
+        checked(None, 'not a list')
+    assert calls == ['not a list']
+
+    with pytest.raises(TypeError):
+        checked(None, 123)
+    with pytest.raises(TypeError):
+        checked(None, 'string', flag='not a bool')
+    assert calls == ['not a list']
+
+    checked_list = check_arg_types(None, list)(
+        check_retval(is_list_of(basestring))(func))
+    assert checked_list(None, ['a', 'b'], flag=True) == ['a', 'b']
+
+
+def test_is_dict_of(monkeypatch):
+    check = is_dict_of(basestring, dict)
+
+    ## Validators are compiled once, not for every key / value
+    def _compile_validator(validator):
+        raise AssertionError("Validator compiled again")
+    monkeypatch.setattr(ckan_api_client, 'compile_validator',
+                        _compile_validator)
+
+    assert check({'a': {}, u'b': {'c': 1}})
+    with pytest.raises(TypeError):
+        check([])
+    with pytest.raises(TypeError):
+        check({1: {}})
+    with pytest.raises(TypeError):
+        check({'a': 'not a dict'})
+
+
+@pytest.mark.parametrize('mode,expected', [
+    ('strict', '10'),
+    ('sample', '3'),
+    ('off', '0'),
+])
+def test_validation_modes(mode, expected):
+    script = '\n'.join([
+        "from ckan_api_client import check_retval",
+        "checks = []",
+        "def checker(value):",
+        "    checks.append(value)",
+        "    return True",
+        "func = check_retval(checker)(lambda x: x)",
+        "for x in range(10):",
+        "    func(x)",
+        "print(len(checks))",
+    ])
+    env = dict(os.environ)
+    env['CKAN_API_CLIENT_VALIDATION'] = mode
+    env['CKAN_API_CLIENT_VALIDATION_SAMPLE'] = '4'
+    here = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.check_output(
+        [sys.executable, '-c', script], env=env, cwd=os.path.dirname(here))
+    assert output.strip() == expected
@@ -0,0 +1,80 @@
+"""
+Dummy HTTP server, running in a background thread, for tests
+needing full control over the responses (failures, encodings,
+connection handling..)
+"""
+
+from SocketServer import ThreadingMixIn
+import BaseHTTPServer
+import json
+import threading
+
+
+class DummyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Base request handler: quiet, with a helper to send JSON.
+
+    Subclasses can set ``protocol_version = 'HTTP/1.1'`` to
+    keep connections alive.
+    """
+
+    def log_message(self, *a):
+        pass
+
+    def reply_json(self, status, data=None):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DummyServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded HTTP server, counting accepted (TCP) connections
+    in ``connections``.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, handler_class, host='127.0.0.1', port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), handler_class)
+        self.url = 'http://{0}:{1}'.format(host, self.server_address[1])
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def get_request(self):
+        conn = BaseHTTPServer.HTTPServer.get_request(self)
+        with self._lock:
+            self.connections += 1
+        return conn
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def dummy_server(request, handler_class, **attrs):
+    """
+    Start a ``DummyServer`` for the duration of a test.
+
+    :param request: the pytest ``request`` fixture
+    :param handler_class: a ``DummyHandler`` subclass
+    :param attrs:
+        attributes to set on the server, eg. to share
+        state with the handler (as ``self.server.<name>``)
+    """
+    server = DummyServer(handler_class)
+    for name, value in attrs.iteritems():
+        setattr(server, name, value)
+    server.start()
+    request.addfinalizer(server.stop)
+    return server
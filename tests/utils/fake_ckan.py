@@ -0,0 +1,733 @@
+"""
+In-process stand-in for the Ckan API, for offline testing
+and benchmarking.
+
+Only the endpoints used by ``CkanClient`` are implemented, keeping
+all the data in memory:
+
+- API v2: ``/rest/dataset``, ``/rest/group``, ``/rest/tag``,
+  ``/rest/licenses``
+- API v3: ``organization_*``, ``group_purge``, ``package_search``
+  (supporting a small subset of the Solr query syntax)
+
+The quirks of the real API documented in ``CkanClient.update_dataset()``
+are reproduced:
+
+- updating a dataset or group without ``extras``, ``groups``,
+  ``resources``, ``tags`` or ``relationships`` flushes them,
+  while omitted "core" fields are kept
+- extras are merged on update: setting a key to None deletes it,
+  and passing an empty dict has no effect
+- deleted datasets are still returned to sysadmins, with
+  ``state = 'deleted'``, and their name can be taken by new datasets;
+  groups and organizations are only gone once purged
+
+Usage::
+
+    with FakeCkanServer(api_key='secret', latency=0.01) as server:
+        client = CkanClient(server.url, 'secret')
+"""
+
+from collections import OrderedDict
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+import copy
+import datetime
+import json
+import re
+import threading
+import time
+import urlparse
+import uuid
+import zlib
+
+from ckan_api_client import DATASET_FIELDS, GROUP_FIELDS, RESOURCE_FIELDS
+
+
+LICENSES = [
+    {'id': 'cc-by', 'title': 'Creative Commons Attribution',
+     'url': 'http://www.opendefinition.org/licenses/cc-by',
+     'is_okd_compliant': True},
+    {'id': 'cc-by-sa', 'title': 'Creative Commons Attribution Share-Alike',
+     'url': 'http://www.opendefinition.org/licenses/cc-by-sa',
+     'is_okd_compliant': True},
+    {'id': 'cc-zero', 'title': 'Creative Commons CCZero',
+     'url': 'http://www.opendefinition.org/licenses/cc-zero',
+     'is_okd_compliant': True},
+    {'id': 'notspecified', 'title': 'License not specified',
+     'url': '', 'is_okd_compliant': False},
+]
+
+## Fields "flushed" when omitted from updates
+DATASET_FLUSHED_FIELDS = ['extras', 'groups', 'relationships', 'resources',
+                          'tags']
+GROUP_FLUSHED_FIELDS = ['extras', 'groups']
+
+## package_search: rows are capped, as by ``search.rows_max``
+SEARCH_ROWS_MAX = 1000
+SEARCH_DATE_FIELDS = ('metadata_created', 'metadata_modified')
+
+NAME_RE = re.compile(r'^[a-z0-9_-]{2,100}$')
+FQ_CLAUSE_RE = re.compile(
+    r'(?P<neg>-?)(?P<field>[\w.-]+):'
+    r'(?P<value>"(?:[^"\\]|\\.)*"|\[[^\]]*\]|\S+)')
+FQ_RANGE_RE = re.compile(r'^\[(\S+) TO (\S+)\]$')
+
+
+class ApiError(Exception):
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.message = message
+
+    def __str__(self):
+        return "ApiError [{0}]: {1}".format(self.status_code, self.message)
+
+
+def parse_date(value):
+    """
+    Parse a Ckan (``2014-05-12T10:11:12.123456``) or Solr
+    (``2014-05-12T10:11:12.123Z``) timestamp
+    """
+    value = value.rstrip('Z')
+    if '.' not in value:
+        value += '.0'
+    base, fraction = value.split('.', 1)
+    date = datetime.datetime.strptime(base, '%Y-%m-%dT%H:%M:%S')
+    return date.replace(microsecond=int(fraction[:6].ljust(6, '0')))
+
+
+def format_solr_date(value):
+    date = parse_date(value)
+    return '{0}.{1:03d}Z'.format(date.strftime('%Y-%m-%dT%H:%M:%S'),
+                                 date.microsecond // 1000)
+
+
+class FakeCkanApp(object):
+    """
+    WSGI application emulating the Ckan API
+    """
+
+    def __init__(self, api_key=None, latency=0):
+        """
+        :param api_key:
+            API key of the sysadmin user. Writes and access to
+            deleted / private datasets require it. If None, all
+            requests are considered authorized.
+        :param latency:
+            seconds to wait before handling each request.
+            Can be changed at any time.
+        """
+        self.api_key = api_key
+        self.latency = latency
+        self.requests = []  # (method, path)
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """Remove all the data"""
+        with self._lock:
+            self.datasets = OrderedDict()  # id: dataset
+            self.groups = OrderedDict()  # id: group or organization
+            self._last_timestamp = None
+
+    ##------------------------------------------------------------
+    ## Request handling
+    ##------------------------------------------------------------
+
+    ROUTES = [
+        ('GET', r'/api/2/rest/dataset', '_list_datasets'),
+        ('POST', r'/api/2/rest/dataset', '_create_dataset'),
+        ('GET', r'/api/2/rest/dataset/([^/]+)', '_show_dataset'),
+        ('PUT', r'/api/2/rest/dataset/([^/]+)', '_update_dataset'),
+        ('POST', r'/api/2/rest/dataset/([^/]+)', '_update_dataset'),
+        ('DELETE', r'/api/2/rest/dataset/([^/]+)', '_delete_dataset'),
+        ('GET', r'/api/2/rest/group', '_list_groups'),
+        ('POST', r'/api/2/rest/group', '_create_group'),
+        ('GET', r'/api/2/rest/group/([^/]+)', '_show_group'),
+        ('PUT', r'/api/2/rest/group/([^/]+)', '_update_group'),
+        ('POST', r'/api/2/rest/group/([^/]+)', '_update_group'),
+        ('DELETE', r'/api/2/rest/group/([^/]+)', '_delete_group'),
+        ('GET', r'/api/2/rest/tag', '_list_tags'),
+        ('GET', r'/api/2/rest/tag/([^/]+)', '_show_tag'),
+        ('GET', r'/api/2/rest/licenses', '_list_licenses'),
+        (None, r'/api/3/action/(\w+)', '_action'),
+    ]
+
+    ACTIONS = {
+        'package_search': '_package_search',
+        'organization_list': '_organization_list',
+        'organization_show': '_organization_show',
+        'organization_create': '_organization_create',
+        'organization_update': '_organization_update',
+        'organization_delete': '_organization_delete',
+        'organization_purge': '_organization_purge',
+        'group_purge': '_group_purge',
+    }
+
+    def __call__(self, environ, start_response):
+        if self.latency:
+            time.sleep(self.latency)
+
+        method = environ['REQUEST_METHOD']
+        path = environ.get('PATH_INFO', '').rstrip('/')
+        self.requests.append((method, path))
+
+        try:
+            handler, args = self._route(method, path)
+            request = self._parse_request(environ)
+            with self._lock:
+                status, body = 200, handler(request, *args)
+        except ApiError as e:
+            status, body = e.status_code, e.message
+            if path.startswith('/api/3/'):
+                body = {'success': False,
+                        'error': {'message': e.message}}
+        else:
+            if path.startswith('/api/3/'):
+                body = {'success': True, 'result': body}
+
+        data = json.dumps(body)
+        start_response('{0} {1}'.format(status, _STATUS_NAMES[status]), [
+            ('Content-Type', 'application/json;charset=utf-8'),
+            ('Content-Length', str(len(data))),
+        ])
+        return [data]
+
+    def _route(self, method, path):
+        found = False
+        for route_method, pattern, handler in self.ROUTES:
+            match = re.match('^{0}$'.format(pattern), path)
+            if match is None:
+                continue
+            found = True
+            if route_method is None or route_method == method:
+                return getattr(self, handler), match.groups()
+        if found:
+            raise ApiError(405, "Method not allowed")
+        raise ApiError(404, "Not found")
+
+    def _parse_request(self, environ):
+        method = environ['REQUEST_METHOD']
+        params = dict(urlparse.parse_qsl(environ.get('QUERY_STRING', '')))
+
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length else ''
+        if environ.get('HTTP_CONTENT_ENCODING') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        data = {}
+        if body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                raise ApiError(400, "Bad request - JSON Error")
+
+        api_key = (environ.get('HTTP_AUTHORIZATION') or
+                   environ.get('HTTP_X_CKAN_API_KEY'))
+        if api_key is not None and self.api_key is not None \
+                and api_key != self.api_key:
+            raise ApiError(403, "Bad API key")
+        is_admin = self.api_key is None or api_key == self.api_key
+        if method != 'GET' and not is_admin:
+            raise ApiError(403, "Access denied")
+
+        return {'method': method, 'params': params, 'data': data,
+                'is_admin': is_admin}
+
+    def _action(self, request, action):
+        if action not in self.ACTIONS:
+            raise ApiError(400, "Action name not known: {0}".format(action))
+        data = dict(request['params'])
+        if isinstance(request['data'], dict):
+            data.update(request['data'])
+        return getattr(self, self.ACTIONS[action])(request, data)
+
+    ##------------------------------------------------------------
+    ## Utilities
+    ##------------------------------------------------------------
+
+    def _timestamp(self):
+        """Current time, always increasing"""
+        now = datetime.datetime.utcnow()
+        if self._last_timestamp is not None and now <= self._last_timestamp:
+            now = self._last_timestamp + datetime.timedelta(microseconds=1)
+        self._last_timestamp = now
+        return now.strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+    def _check_name(self, name, objects, obj_id=None):
+        if not isinstance(name, basestring) or not NAME_RE.match(name):
+            raise ApiError(409, "Invalid name: {0!r}".format(name))
+        for other in objects.values():
+            if other['name'] != name or other['id'] == obj_id:
+                continue
+            if other['state'] != 'deleted':
+                raise ApiError(409, "That URL is already in use.")
+            ## Names of deleted objects can be reused
+            other['name'] = other['id']
+
+    def _lookup(self, objects, ref):
+        if ref in objects:
+            return objects[ref]
+        for obj in objects.itervalues():
+            if obj['name'] == ref:
+                return obj
+        return None
+
+    def _update_extras(self, obj, data):
+        if 'extras' not in data:
+            obj['extras'] = {}  # flushed!
+            return
+        extras = data['extras']
+        if isinstance(extras, list):  # API v3 format
+            extras = dict((x['key'], x.get('value')) for x in extras)
+        for key, value in extras.iteritems():
+            if value is None:
+                obj['extras'].pop(key, None)
+            else:
+                obj['extras'][key] = value
+
+    ##------------------------------------------------------------
+    ## Datasets
+    ##------------------------------------------------------------
+
+    def _get_dataset(self, request, ref):
+        dataset = self._lookup(self.datasets, ref)
+        if dataset is None:
+            raise ApiError(404, "Not found")
+        if not request['is_admin'] and (
+                dataset['state'] != 'active' or dataset['private']):
+            raise ApiError(403, "Access denied")
+        return dataset
+
+    def _visible_datasets(self, request):
+        return [x for x in self.datasets.itervalues()
+                if x['state'] == 'active'
+                and (request['is_admin'] or not x['private'])]
+
+    def _resolve_group(self, ref, is_organization=False):
+        if isinstance(ref, dict):
+            ref = ref.get('id') or ref.get('name')
+        group = self._lookup(self.groups, ref)
+        if group is None or group['is_organization'] != is_organization:
+            raise ApiError(409, "Group not found: {0!r}".format(ref))
+        return group['id']
+
+    def _save_dataset(self, data, dataset=None):
+        if not isinstance(data, dict):
+            raise ApiError(400, "Bad request")
+
+        now = self._timestamp()
+        if dataset is None:
+            dataset = {
+                'id': str(uuid.uuid4()),
+                'name': None, 'title': '', 'version': None,
+                'metadata_created': now,
+            }
+            dataset.update(dict.fromkeys(DATASET_FIELDS['core']))
+            dataset.update({'private': False, 'state': 'active',
+                            'type': 'dataset', 'extras': {}})
+            if 'name' not in data:
+                raise ApiError(409, "Missing value: name")
+
+        for field in DATASET_FIELDS['core'] + ['title', 'version']:
+            if field in data:
+                dataset[field] = data[field]
+        self._check_name(dataset['name'], self.datasets, dataset['id'])
+
+        if dataset['owner_org'] is not None:
+            dataset['owner_org'] = self._resolve_group(
+                dataset['owner_org'], is_organization=True)
+
+        self._update_extras(dataset, data)
+        dataset['groups'] = [self._resolve_group(x)
+                             for x in data.get('groups') or []]
+        dataset['tags'] = [x['name'] if isinstance(x, dict) else x
+                           for x in data.get('tags') or []]
+        dataset['relationships'] = list(data.get('relationships') or [])
+
+        old_resources = dict(
+            (x['id'], x) for x in dataset.get('resources', []))
+        resources = []
+        for position, item in enumerate(data.get('resources') or []):
+            resource = dict.fromkeys(RESOURCE_FIELDS['core'])
+            old_resource = old_resources.get(item.get('id')) or {}
+            resource.update(hash='', created=old_resource.get('created', now))
+            resource.update((k, v) for k, v in item.iteritems()
+                            if k in RESOURCE_FIELDS['core'] + ['id', 'hash'])
+            resource.setdefault('id', None)
+            resource['id'] = resource['id'] or str(uuid.uuid4())
+            resource.update(position=position, package_id=dataset['id'])
+            resources.append(resource)
+        dataset['resources'] = resources
+
+        licenses = dict((x['id'], x) for x in LICENSES)
+        license = licenses.get(dataset['license_id']) or {}
+        dataset.update({
+            'metadata_modified': now,
+            'revision_id': str(uuid.uuid4()),
+            'license_title': license.get('title', dataset['license_id']),
+            'license_url': license.get('url'),
+            'isopen': license.get('is_okd_compliant', False),
+            'num_resources': len(dataset['resources']),
+            'num_tags': len(dataset['tags']),
+            'ratings_average': None,
+            'ratings_count': 0,
+            'ckan_url': '/dataset/{0}'.format(dataset['name']),
+        })
+
+        self.datasets[dataset['id']] = dataset
+        return copy.deepcopy(dataset)
+
+    def _list_datasets(self, request):
+        return [x['id'] for x in self._visible_datasets(request)]
+
+    def _create_dataset(self, request):
+        return self._save_dataset(request['data'])
+
+    def _show_dataset(self, request, ref):
+        return copy.deepcopy(self._get_dataset(request, ref))
+
+    def _update_dataset(self, request, ref):
+        dataset = copy.deepcopy(self._get_dataset(request, ref))
+        return self._save_dataset(request['data'], dataset)
+
+    def _delete_dataset(self, request, ref):
+        dataset = self._get_dataset(request, ref)
+        dataset['state'] = 'deleted'
+        dataset['metadata_modified'] = self._timestamp()
+        return ''
+
+    ##------------------------------------------------------------
+    ## Groups and organizations
+    ##------------------------------------------------------------
+
+    def _get_group(self, ref, is_organization=False):
+        group = self._lookup(self.groups, ref)
+        if group is None or group['is_organization'] != is_organization:
+            raise ApiError(404, "Not found")
+        return group
+
+    def _save_group(self, data, group=None, is_organization=False):
+        if not isinstance(data, dict):
+            raise ApiError(400, "Bad request")
+
+        if group is None:
+            group = {
+                'id': str(uuid.uuid4()),
+                'created': self._timestamp(),
+            }
+            group.update(dict.fromkeys(GROUP_FIELDS['core'], ''))
+            group.update({
+                'approval_status': 'approved', 'state': 'active',
+                'is_organization': is_organization, 'extras': {},
+                'type': 'organization' if is_organization else 'group',
+            })
+            if 'name' not in data:
+                raise ApiError(409, "Missing value: name")
+
+        for field in GROUP_FIELDS['core']:
+            if field in data and field not in ('is_organization', 'type'):
+                group[field] = data[field]
+        self._check_name(group['name'], self.groups, group['id'])
+
+        self._update_extras(group, data)
+        group['groups'] = list(data.get('groups') or [])
+        group.update({
+            'revision_id': str(uuid.uuid4()),
+            'display_name': group['title'] or group['name'],
+            'tags': [],
+            'users': [],
+        })
+
+        self.groups[group['id']] = group
+        return group
+
+    def _group_packages(self, group):
+        if group['is_organization']:
+            return [x['id'] for x in self.datasets.itervalues()
+                    if x['state'] == 'active'
+                    and x['owner_org'] == group['id']]
+        return [x['id'] for x in self.datasets.itervalues()
+                if x['state'] == 'active' and group['id'] in x['groups']]
+
+    def _group_v2(self, group):
+        group = copy.deepcopy(group)
+        group['packages'] = self._group_packages(group)
+        return group
+
+    def _group_v3(self, group):
+        group = copy.deepcopy(group)
+        group['extras'] = [{'key': k, 'value': v}
+                           for k, v in sorted(group['extras'].iteritems())]
+        group['packages'] = [
+            {'id': x, 'name': self.datasets[x]['name']}
+            for x in self._group_packages(group)]
+        group['package_count'] = len(group['packages'])
+        return group
+
+    def _purge_group(self, group):
+        del self.groups[group['id']]
+        for dataset in self.datasets.itervalues():
+            if group['id'] in dataset['groups']:
+                dataset['groups'].remove(group['id'])
+            if dataset['owner_org'] == group['id']:
+                dataset['owner_org'] = None
+
+    def _list_groups(self, request):
+        return [x['id'] for x in self.groups.itervalues()
+                if not x['is_organization'] and x['state'] == 'active']
+
+    def _create_group(self, request):
+        return self._group_v2(self._save_group(request['data']))
+
+    def _show_group(self, request, ref):
+        return self._group_v2(self._get_group(ref))
+
+    def _update_group(self, request, ref):
+        group = copy.deepcopy(self._get_group(ref))
+        return self._group_v2(self._save_group(request['data'], group))
+
+    def _delete_group(self, request, ref):
+        self._get_group(ref)['state'] = 'deleted'
+        return ''
+
+    def _group_purge(self, request, data):
+        self._purge_group(self._get_group(data.get('id')))
+        return None
+
+    def _organization_list(self, request, data):
+        return sorted(x['name'] for x in self.groups.itervalues()
+                      if x['is_organization'] and x['state'] == 'active')
+
+    def _organization_show(self, request, data):
+        return self._group_v3(self._get_group(data.get('id'), True))
+
+    def _organization_create(self, request, data):
+        return self._group_v3(self._save_group(data, is_organization=True))
+
+    def _organization_update(self, request, data):
+        group = copy.deepcopy(self._get_group(data.get('id'), True))
+        return self._group_v3(self._save_group(data, group, True))
+
+    def _organization_delete(self, request, data):
+        self._get_group(data.get('id'), True)['state'] = 'deleted'
+        return None
+
+    def _organization_purge(self, request, data):
+        self._purge_group(self._get_group(data.get('id'), True))
+        return None
+
+    ##------------------------------------------------------------
+    ## Tags and licenses
+    ##------------------------------------------------------------
+
+    def _list_tags(self, request):
+        return sorted(set(tag for x in self._visible_datasets(request)
+                          for tag in x['tags']))
+
+    def _show_tag(self, request, tag):
+        datasets = [copy.deepcopy(x) for x in self._visible_datasets(request)
+                    if tag in x['tags']]
+        if len(datasets) == 0:
+            raise ApiError(404, "Not found")
+        return datasets
+
+    def _list_licenses(self, request):
+        return copy.deepcopy(LICENSES)
+
+    ##------------------------------------------------------------
+    ## Search
+    ##------------------------------------------------------------
+
+    def _search_value(self, dataset, field):
+        if field.startswith('extras_'):
+            return dataset['extras'].get(field[len('extras_'):])
+        if field == 'groups':
+            return [self.groups[x]['name'] for x in dataset['groups']]
+        if field == 'organization':
+            org = self.groups.get(dataset['owner_org'])
+            return org['name'] if org else None
+        return dataset.get(field)
+
+    def _parse_query(self, query):
+        """
+        Parse a (very) small subset of the Solr syntax: clauses
+        like ``field:value``, ``field:"value"`` or ``field:[a TO b]``,
+        optionally negated with ``-``, that must all match.
+
+        :return: a list of functions called as ``match(dataset)``
+        """
+        query = (query or '').strip()
+        if query in ('', '*:*'):
+            return []
+
+        matchers = []
+        pos = 0
+        for match in FQ_CLAUSE_RE.finditer(query):
+            skipped = query[pos:match.start()].strip()
+            if skipped not in ('', 'AND'):
+                raise ApiError(409, "Unsupported query: {0!r}".format(query))
+            pos = match.end()
+            matchers.append(self._clause_matcher(
+                match.group('field'), match.group('value'),
+                bool(match.group('neg'))))
+        if query[pos:].strip():
+            raise ApiError(409, "Unsupported query: {0!r}".format(query))
+        return matchers
+
+    def _clause_matcher(self, field, value, negated):
+        is_date = field in SEARCH_DATE_FIELDS
+        range_match = FQ_RANGE_RE.match(value)
+
+        if range_match is not None:
+            bounds = [None if x == '*' else (parse_date(x) if is_date else x)
+                      for x in range_match.groups()]
+
+            def _match_value(x):
+                x = parse_date(x) if is_date else x
+                return ((bounds[0] is None or x >= bounds[0]) and
+                        (bounds[1] is None or x <= bounds[1]))
+
+        elif value == '*':
+            _match_value = bool
+
+        else:
+            if value.startswith('"'):
+                value = re.sub(r'\\(.)', r'\1', value[1:-1])
+            if field.startswith('extras_'):
+                ## Extras are indexed as text: loosely match phrases
+                def _match_value(x):
+                    return value.lower() in unicode(x).lower()
+            else:
+                def _match_value(x):
+                    return unicode(x) == value
+
+        def matcher(dataset):
+            values = self._search_value(dataset, field)
+            if not isinstance(values, list):
+                values = [values]
+            matched = any(_match_value(x) for x in values if x is not None)
+            return matched != negated
+
+        return matcher
+
+    def _sort_datasets(self, datasets, sort):
+        for clause in reversed((sort or '').split(',')):
+            clause = clause.split()
+            if len(clause) == 0 or clause[0] == 'score':
+                continue
+            field = clause[0]
+            reverse = len(clause) > 1 and clause[1] == 'desc'
+
+            def _key(dataset):
+                value = self._search_value(dataset, field)
+                if field in SEARCH_DATE_FIELDS and value is not None:
+                    value = parse_date(value)
+                return value
+
+            datasets.sort(key=_key, reverse=reverse)
+        return datasets
+
+    def _dataset_v3(self, dataset, fl=None):
+        if fl:
+            result = {}
+            for field in fl:
+                value = self._search_value(dataset, field)
+                if value is None:
+                    continue
+                if field in SEARCH_DATE_FIELDS:
+                    value = format_solr_date(value)
+                result[field] = value
+            return result
+
+        result = copy.deepcopy(dataset)
+        result['extras'] = [{'key': k, 'value': v}
+                            for k, v in sorted(dataset['extras'].iteritems())]
+        result['groups'] = [
+            {'id': x, 'name': self.groups[x]['name'],
+             'title': self.groups[x]['title']}
+            for x in dataset['groups']]
+        result['tags'] = [{'name': x, 'display_name': x}
+                          for x in dataset['tags']]
+        org = self.groups.get(dataset['owner_org'])
+        result['organization'] = (
+            None if org is None else
+            {'id': org['id'], 'name': org['name'], 'title': org['title']})
+        del result['relationships']
+        return result
+
+    def _package_search(self, request, data):
+        matchers = (self._parse_query(data.get('q')) +
+                    self._parse_query(data.get('fq')))
+        ## Like Ckan, private datasets must be explicitly requested
+        include_private = str(data.get('include_private')).lower() \
+            in ('true', '1')
+        datasets = [x for x in self._visible_datasets(request)
+                    if all(m(x) for m in matchers)
+                    and (include_private or not x['private'])]
+        self._sort_datasets(
+            datasets, data.get('sort') or 'metadata_modified desc')
+
+        try:
+            rows = min(int(data.get('rows', 10)), SEARCH_ROWS_MAX)
+            start = int(data.get('start', 0))
+        except ValueError:
+            raise ApiError(409, "Invalid integer")
+        fl = data.get('fl')
+        fl = fl.replace(',', ' ').split() if fl else None
+
+        return {
+            'count': len(datasets),
+            'results': [self._dataset_v3(x, fl)
+                        for x in datasets[start:start + rows]],
+        }
+
+
+_STATUS_NAMES = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 409: 'Conflict',
+}
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, *a):
+        pass
+
+
+class FakeCkanServer(object):
+    """
+    Serve a ``FakeCkanApp`` over HTTP, from a background thread
+    """
+
+    def __init__(self, api_key=None, latency=0, host='127.0.0.1', port=0):
+        """
+        :param api_key: see ``FakeCkanApp``
+        :param latency: see ``FakeCkanApp``
+        :param port: port to listen on; by default a free one is picked
+        """
+        self.app = FakeCkanApp(api_key=api_key, latency=latency)
+        self._server = make_server(
+            host, port, self.app, server_class=_ThreadingWSGIServer,
+            handler_class=_QuietRequestHandler)
+        self.url = 'http://{0}:{1}'.format(host, self._server.server_port)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
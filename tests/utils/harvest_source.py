@@ -2,13 +2,150 @@
 Utilities for real-case harvesting scenario
 """
 
-from collections import Mapping
-import os
+from collections import Mapping, OrderedDict
+import hashlib
+import itertools
 import json
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+import zlib
+
+from ckan_api_client import canonical_json
+
+## scandir() saves a stat() call per entry, when listing directories.
+## It's in the standard library since Python 3.5, and available
+## as a backport for older versions.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 
 HARVEST_SOURCE_NAME = 'dummy-harvest-source'
 
+## Default number of parsed records kept in memory, per source
+DEFAULT_CACHE_SIZE = 1000
+
+
+class RecordCache(object):
+    """
+    Bounded LRU cache of parsed records.
+
+    Records are shared between callers, to make repeated access
+    nearly free: callers needing to modify them must make a copy
+    first (as ``sync_data()`` does).
+    """
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        """
+        :param size:
+            maximum number of records to keep. Use 0 to disable caching.
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """
+        Get a record from the cache, calling ``load()``
+        to get it on cache misses.
+        """
+        with self._lock:
+            record = self._records.pop(key, None)
+            if record is not None:
+                self._records[key] = record  # most recently used
+                self.hits += 1
+                return record
+            self.misses += 1
+
+        record = load()
+        if self.size <= 0:
+            return record
+
+        with self._lock:
+            self._records[key] = record
+            while len(self._records) > self.size:
+                self._records.popitem(last=False)
+        return record
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def stats(self):
+        return {'size': len(self._records), 'hits': self.hits,
+                'misses': self.misses}
+
+
+class DirectoryIndex(object):
+    """
+    Cached listing of a directory.
+
+    The listing is rebuilt only when the directory modification time
+    changes, so that looking up entries doesn't require listing the
+    directory every time.
+    """
+
+    def __init__(self, path, dirs=False):
+        """
+        :param path: path to the directory
+        :param dirs:
+            if True, index subdirectories, otherwise
+            index regular files
+        """
+        self.path = path
+        self.dirs = dirs
+        self._mtime = None
+        self._names = []
+        self._names_set = frozenset()
+
+    def _refresh(self):
+        mtime = os.stat(self.path).st_mtime
+        if mtime == self._mtime:
+            return
+
+        names = [name for name, is_dir in self._list()
+                 if is_dir == self.dirs]
+
+        self._names = names
+        self._names_set = frozenset(names)
+        self._mtime = mtime
+
+    def _list(self):
+        """Yield ``(name, is_dir)`` tuples, skipping hidden files"""
+        if scandir is not None:
+            for entry in scandir(self.path):
+                if not entry.name.startswith('.'):
+                    yield entry.name, entry.is_dir()
+            return
+
+        for name in os.listdir(self.path):
+            if not name.startswith('.'):
+                yield name, os.path.isdir(os.path.join(self.path, name))
+
+    @property
+    def names(self):
+        self._refresh()
+        return self._names
+
+    def __contains__(self, name):
+        self._refresh()
+        return name in self._names_set
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
 
 class HarvestSource(Mapping):
     """
@@ -18,38 +155,38 @@ class HarvestSource(Mapping):
     ## Default harvest source..
     source_name = HARVEST_SOURCE_NAME
 
-    def __init__(self, base_dir, day):
+    def __init__(self, base_dir, day, cache_size=DEFAULT_CACHE_SIZE):
         """
         :param day:
             The day from which to get data.
             Full name, like 'day-00', 'day-01', ..
+        :param cache_size:
+            number of parsed records to keep in memory,
+            see ``RecordCache``
         """
         self.base_dir = base_dir
         self.day = day
+        self.cache = RecordCache(cache_size)
+        self._index = DirectoryIndex(
+            os.path.join(base_dir, day), dirs=True)
+        self._collections = {}
 
     def __getitem__(self, name):
-        if name not in self.__iter__():
+        if name not in self._index:
             raise KeyError("No such object type: {0!r}".format(name))
-        return HarvestSourceCollection(self, name)
+        if name not in self._collections:
+            self._collections[name] = HarvestSourceCollection(self, name)
+        return self._collections[name]
+
+    def __contains__(self, name):
+        return name in self._index
 
     def __iter__(self):
         """List object types"""
-
-        folder = os.path.join(self.base_dir, self.day)
-        for name in os.listdir(folder):
-            ## Skip hidden files
-            if name.startswith('.'):
-                continue
-
-            ## Skip non-directories
-            path = os.path.join(folder, name)
-            if not os.path.isdir(path):
-                continue
-
-            yield name
+        return iter(self._index)
 
     def __len__(self):
-        return len(list(self.__iter__()))
+        return len(self._index)
 
 
 class HarvestSourceCollection(Mapping):
@@ -60,38 +197,411 @@ class HarvestSourceCollection(Mapping):
     def __init__(self, source, name):
         self.source = source
         self.name = name
+        self.folder = os.path.join(source.base_dir, source.day, name)
+        self._index = DirectoryIndex(self.folder)
 
     def __getitem__(self, name):
-        if name not in self.__iter__():
+        if name not in self._index:
             raise KeyError("There is no object of type={0!r} id={1!r}"
                            .format(self.name, name))
-        folder = os.path.join(self.source.base_dir, self.source.day, self.name)
-        path = os.path.join(folder, name)
-
-        with open(path, 'r') as f:
-            data = json.load(f)
-            if 'id' in data:
-                if data['id'] != name:
-                    raise ValueError("Mismatching dataset id -- bad data?")
-            data['id'] = name  # make sure we pass it back
+        return self.source.cache.get(
+            (self.name, name), lambda: self._load(name))
+
+    def _load(self, name):
+        return load_record_file(os.path.join(self.folder, name))
+
+    def iter_items(self, processes=None, chunksize=64):
+        """
+        Iterate all the ``(id, record)`` pairs in the collection,
+        parsing files in parallel on a pool of processes.
+
+        Records are yielded in the same order as ``iter(collection)``,
+        as soon as they're ready, and are not cached.
+
+        :param processes:
+            number of processes to use, defaults to the number of CPUs.
+            Use 1 to parse files in the current process.
+        :param chunksize:
+            number of files sent to workers at once
+        """
+        names = list(self._index)
+        paths = [os.path.join(self.folder, name) for name in names]
+
+        if processes == 1:
+            for name, path in itertools.izip(names, paths):
+                yield name, load_record_file(path)
+            return
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            records = pool.imap(load_record_file, paths, chunksize)
+            for name, record in itertools.izip(names, records):
+                yield name, record
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def load_all(self, processes=None, chunksize=64):
+        """
+        Load the whole collection in a dict, see ``iter_items()``
+        """
+        return dict(self.iter_items(processes=processes, chunksize=chunksize))
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        """List object ids"""
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+def load_record_file(path):
+    """
+    Load a record from a harvest source file.
+
+    The file name is the record id; it will be set as ``id``
+    in the returned record.
+    """
+    name = os.path.basename(path)
+
+    with open(path, 'r') as f:
+        data = json.load(f)
+        if 'id' in data:
+            if data['id'] != name:
+                raise ValueError("Mismatching dataset id -- bad data?")
+        data['id'] = name  # make sure we pass it back
+
+    return data
+
+
+def record_hash(record):
+    """Hash of the canonical JSON representation of a record"""
+    return hashlib.sha1(canonical_json(record)).hexdigest()
+
+
+def _iter_record_hashes(collection):
+    if hasattr(collection, 'record_hashes'):
+        return collection.record_hashes().iteritems()
+    return ((x, record_hash(collection[x])) for x in collection)
+
+
+def harvest_source_delta(old, new, obj_types=None):
+    """
+    Compute differences between two harvest sources (eg. two days),
+    without touching Ckan.
+
+    Records are compared by hashing their canonical JSON, and only
+    the hashes of the ``old`` source are kept in memory. Collections
+    already knowing the hashes of their records can expose them
+    via a ``record_hashes()`` method, returning a {<id>: <hash>} dict.
+
+    :param old: the previous harvest source
+    :param new: the current harvest source
+    :param obj_types:
+        object types to compare. Defaults to all the types
+        in any of the sources.
+
+    :return: a dict mapping object types to dicts with
+        ``created``, ``changed`` and ``removed`` (sorted) lists of ids.
+    """
+
+    if obj_types is None:
+        obj_types = sorted(set(old) | set(new))
+
+    delta = {}
+    for obj_type in obj_types:
+        old_items = old[obj_type] if obj_type in old else {}
+        new_items = new[obj_type] if obj_type in new else {}
+
+        old_hashes = dict(_iter_record_hashes(old_items))
+        created, changed = [], []
+
+        for obj_id, obj_hash in _iter_record_hashes(new_items):
+            if obj_id not in old_hashes:
+                created.append(obj_id)
+            elif old_hashes.pop(obj_id) != obj_hash:
+                changed.append(obj_id)
+
+        ## Remaining ones were removed from the new source
+        delta[obj_type] = {
+            'created': sorted(created),
+            'changed': sorted(changed),
+            'removed': sorted(old_hashes),
+        }
+
+    return delta
+
+
+##----------------------------------------------------------------------
+## Packed harvest sources
+##----------------------------------------------------------------------
+## A whole "day" is stored in a single file, laid out as follows:
+##
+## - the PACK_MAGIC header
+## - JSON records, one per line
+## - the index, as a JSON object: {<type>: {<id>: [offset, length]}}
+## - the offset of the index, as a little-endian unsigned 64bit int
+##
+## Records are read lazily, via mmap.
+##----------------------------------------------------------------------
+
+PACK_MAGIC = 'HARVESTPACK1\n'
+PACK_TRAILER = struct.Struct('<Q')
 
+
+def pack_harvest_source(source, path):
+    """
+    Convert a harvest source to the packed format.
+
+    :param source:
+        the source to be converted, usually a ``HarvestSource``
+    :param path: path to the file to be created
+    """
+    index = {}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(PACK_MAGIC)
+        for obj_type in source:
+            index[obj_type] = type_index = {}
+            for obj_id in source[obj_type]:
+                record = json.dumps(source[obj_type][obj_id]) + '\n'
+                type_index[obj_id] = [f.tell(), len(record)]
+                f.write(record)
+        index_offset = f.tell()
+        f.write(json.dumps(index))
+        f.write(PACK_TRAILER.pack(index_offset))
+    os.rename(tmp_path, path)
+
+
+class PackedHarvestSource(Mapping):
+    """
+    Provides dict-like access to packed harvest sources,
+    as created by ``pack_harvest_source()``.
+    """
+
+    ## Default harvest source..
+    source_name = HARVEST_SOURCE_NAME
+
+    def __init__(self, path, cache_size=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.cache = RecordCache(cache_size)
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(PACK_MAGIC)] != PACK_MAGIC:
+            raise ValueError("Not a packed harvest source: {0}".format(path))
+
+        trailer_offset = len(self._mmap) - PACK_TRAILER.size
+        index_offset, = PACK_TRAILER.unpack(self._mmap[trailer_offset:])
+        self._index = json.loads(self._mmap[index_offset:trailer_offset])
+        self._collections = {}
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read_record(self, offset, length):
+        return json.loads(self._mmap[offset:offset + length])
+
+    def __getitem__(self, name):
+        if name not in self._index:
+            raise KeyError("No such object type: {0!r}".format(name))
+        if name not in self._collections:
+            self._collections[name] = PackedHarvestSourceCollection(
+                self, name, self._index[name])
+        return self._collections[name]
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        """List object types"""
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+class PackedHarvestSourceCollection(Mapping):
+    """
+    A "collection" of items in a packed harvest source.
+    """
+
+    def __init__(self, source, name, index):
+        self.source = source
+        self.name = name
+        self._index = index
+
+    def __getitem__(self, name):
+        if name not in self._index:
+            raise KeyError("There is no object of type={0!r} id={1!r}"
+                           .format(self.name, name))
+        return self.source.cache.get(
+            (self.name, name), lambda: self._load(name))
+
+    def _load(self, name):
+        data = self.source.read_record(*self._index[name])
+        data['id'] = name  # make sure we pass it back
         return data
 
+    def __contains__(self, name):
+        return name in self._index
+
     def __iter__(self):
         """List object ids"""
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+##----------------------------------------------------------------------
+## Archived harvest sources
+##----------------------------------------------------------------------
+## As written by ``scripts/download_ckan_data.py --archive``:
+## each object type is stored in ``<type>.jsonl.gz``, made of gzip
+## members each holding a block of JSON lines, with an index in
+## ``<type>.jsonl.gz.idx``, holding a JSON line per block:
+## ``{"offset": .., "length": .., "keys": [..], "names": [..]}``
+##----------------------------------------------------------------------
 
-        folder = os.path.join(self.source.base_dir, self.source.day, self.name)
-        for name in os.listdir(folder):
-            ## Skip hidden files
-            if name.startswith('.'):
-                continue
+ARCHIVE_EXT = '.jsonl.gz'
+ARCHIVE_INDEX_EXT = '.idx'
 
-            ## Skip non-files
-            path = os.path.join(folder, name)
-            if not os.path.isfile(path):
-                continue
 
-            yield name
+class ArchiveHarvestSource(Mapping):
+    """
+    Provides dict-like access to archived harvest sources,
+    without unpacking them.
+    """
+
+    ## Default harvest source..
+    source_name = HARVEST_SOURCE_NAME
+
+    def __init__(self, path, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :param path: directory containing the archives
+        """
+        self.path = path
+        self.cache = RecordCache(cache_size)
+        self._types = sorted(
+            name[:-len(ARCHIVE_EXT)] for name in os.listdir(path)
+            if name.endswith(ARCHIVE_EXT) and os.path.exists(
+                os.path.join(path, name + ARCHIVE_INDEX_EXT)))
+        self._collections = {}
+
+    def close(self):
+        for collection in self._collections.itervalues():
+            collection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getitem__(self, name):
+        if name not in self._types:
+            raise KeyError("No such object type: {0!r}".format(name))
+        if name not in self._collections:
+            self._collections[name] = ArchiveHarvestSourceCollection(
+                self, name)
+        return self._collections[name]
+
+    def __contains__(self, name):
+        return name in self._types
+
+    def __iter__(self):
+        """List object types"""
+        return iter(self._types)
+
+    def __len__(self):
+        return len(self._types)
+
+
+class ArchiveHarvestSourceCollection(Mapping):
+    """
+    A "collection" of items in an archived harvest source.
+
+    Blocks are decompressed on access; the last one is kept
+    around, so that iterating items in order decompresses
+    each block only once.
+    """
+
+    def __init__(self, source, name):
+        self.source = source
+        self.name = name
+
+        archive_path = os.path.join(source.path, name + ARCHIVE_EXT)
+        self._names = []
+        self._index = {}  # name: (offset, length, position)
+        with open(archive_path + ARCHIVE_INDEX_EXT, 'r') as f:
+            for line in f:
+                try:
+                    block = json.loads(line)
+                except ValueError:
+                    break  # truncated line, from an interrupted download
+                for position, obj_name in enumerate(block['names']):
+                    self._names.append(obj_name)
+                    self._index[obj_name] = (
+                        block['offset'], block['length'], position)
+
+        self._file = open(archive_path, 'rb')
+        self._mmap = None
+        if len(self._index) > 0:
+            ## Cannot mmap empty files
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        self._last_block = (None, None)
+        self._lock = threading.Lock()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def _read_block(self, offset, length):
+        with self._lock:
+            if self._last_block[0] == offset:
+                return self._last_block[1]
+        data = zlib.decompress(self._mmap[offset:offset + length],
+                               16 + zlib.MAX_WBITS)
+        lines = data.splitlines()
+        with self._lock:
+            self._last_block = (offset, lines)
+        return lines
+
+    def __getitem__(self, name):
+        if name not in self._index:
+            raise KeyError("There is no object of type={0!r} id={1!r}"
+                           .format(self.name, name))
+        return self.source.cache.get(
+            (self.name, name), lambda: self._load(name))
+
+    def _load(self, name):
+        offset, length, position = self._index[name]
+        data = json.loads(self._read_block(offset, length)[position])
+        if isinstance(data, dict):
+            data['id'] = name  # make sure we pass it back
+        return data
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        """List object ids"""
+        return iter(self._names)
 
     def __len__(self):
-        return len(list(self.__iter__()))
+        return len(self._names)
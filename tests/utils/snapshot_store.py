@@ -0,0 +1,212 @@
+"""
+Content-addressed store for harvest source snapshots.
+
+Each record is saved only once, keyed by the hash of its canonical
+JSON; each day is just a manifest mapping ids to hashes::
+
+    <path>/objects/<hash[:2]>/<hash>
+    <path>/manifests/<day>.json  -- {<type>: {<id>: <hash>}}
+
+so disk usage grows with the changes between days, instead of with
+the size of the catalog.
+"""
+
+from collections import Mapping
+import json
+import os
+
+from ckan_api_client import canonical_json
+
+from .harvest_source import (
+    DEFAULT_CACHE_SIZE, HARVEST_SOURCE_NAME, RecordCache,
+    harvest_source_delta, record_hash)
+
+
+def _write_file_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
+
+
+class SnapshotStore(object):
+    """
+    Store for harvest source snapshots (days)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.objects_dir = os.path.join(path, 'objects')
+        self.manifests_dir = os.path.join(path, 'manifests')
+        for folder in (self.objects_dir, self.manifests_dir):
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+
+    def _object_path(self, obj_hash):
+        return os.path.join(self.objects_dir, obj_hash[:2], obj_hash)
+
+    def _manifest_path(self, day):
+        return os.path.join(self.manifests_dir, day + '.json')
+
+    def put_object(self, record):
+        """
+        Store a record, if not already there.
+
+        :return: the record hash
+        """
+        obj_hash = record_hash(record)
+        path = self._object_path(obj_hash)
+        if not os.path.exists(path):
+            folder = os.path.dirname(path)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            _write_file_atomic(path, canonical_json(record))
+        return obj_hash
+
+    def get_object(self, obj_hash):
+        with open(self._object_path(obj_hash), 'r') as f:
+            return json.load(f)
+
+    def import_source(self, source, day):
+        """
+        Store a snapshot of a harvest source.
+
+        :param source:
+            the source to be imported, usually a ``HarvestSource``
+        :param day: name of the day, eg. 'day-00'
+        :return: the manifest, as {<type>: {<id>: <hash>}}
+        """
+        manifest = {}
+        for obj_type in source:
+            manifest[obj_type] = type_manifest = {}
+            for obj_id in source[obj_type]:
+                type_manifest[obj_id] = self.put_object(
+                    source[obj_type][obj_id])
+        _write_file_atomic(self._manifest_path(day), json.dumps(manifest))
+        return manifest
+
+    def get_manifest(self, day):
+        path = self._manifest_path(day)
+        if not os.path.exists(path):
+            raise KeyError("No such day: {0!r}".format(day))
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def days(self):
+        """List stored days"""
+        return sorted(
+            name[:-len('.json')] for name in os.listdir(self.manifests_dir)
+            if name.endswith('.json'))
+
+    def remove_day(self, day):
+        """
+        Remove the manifest of a day. Objects are not removed
+        until ``collect_garbage()`` is called.
+        """
+        os.unlink(self._manifest_path(day))
+
+    def collect_garbage(self):
+        """
+        Remove objects not referenced by any manifest.
+
+        :return: the number of removed objects
+        """
+        referenced = set()
+        for day in self.days():
+            for type_manifest in self.get_manifest(day).itervalues():
+                referenced.update(type_manifest.itervalues())
+
+        removed = 0
+        for folder in os.listdir(self.objects_dir):
+            folder = os.path.join(self.objects_dir, folder)
+            for obj_hash in os.listdir(folder):
+                if obj_hash not in referenced:
+                    os.unlink(os.path.join(folder, obj_hash))
+                    removed += 1
+        return removed
+
+    def get_source(self, day, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        Get a stored day, as a harvest source
+
+        :rtype: SnapshotHarvestSource
+        """
+        return SnapshotHarvestSource(self, day, cache_size=cache_size)
+
+    def __getitem__(self, day):
+        return self.get_source(day)
+
+    def diff(self, old_day, new_day, obj_types=None):
+        """
+        Compare two days, by their manifests only.
+        See ``harvest_source_delta()`` for the returned value.
+        """
+        return harvest_source_delta(
+            self[old_day], self[new_day], obj_types=obj_types)
+
+
+class SnapshotHarvestSource(Mapping):
+    """
+    Provides dict-like access to a day in a ``SnapshotStore``
+    """
+
+    ## Default harvest source..
+    source_name = HARVEST_SOURCE_NAME
+
+    def __init__(self, store, day, cache_size=DEFAULT_CACHE_SIZE):
+        self.store = store
+        self.day = day
+        self.cache = RecordCache(cache_size)
+        self._manifest = store.get_manifest(day)
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._manifest:
+            raise KeyError("No such object type: {0!r}".format(name))
+        if name not in self._collections:
+            self._collections[name] = SnapshotHarvestSourceCollection(
+                self, name, self._manifest[name])
+        return self._collections[name]
+
+    def __contains__(self, name):
+        return name in self._manifest
+
+    def __iter__(self):
+        """List object types"""
+        return iter(self._manifest)
+
+    def __len__(self):
+        return len(self._manifest)
+
+
+class SnapshotHarvestSourceCollection(Mapping):
+    """
+    A "collection" of items in a stored snapshot
+    """
+
+    def __init__(self, source, name, manifest):
+        self.source = source
+        self.name = name
+        self._manifest = manifest
+
+    def record_hashes(self):
+        """Map ids to record hashes, see ``harvest_source_delta()``"""
+        return self._manifest
+
+    def __getitem__(self, name):
+        if name not in self._manifest:
+            raise KeyError("There is no object of type={0!r} id={1!r}"
+                           .format(self.name, name))
+        return self.source.cache.get(
+            (self.name, name),
+            lambda: self.source.store.get_object(self._manifest[name]))
+
+    def __contains__(self, name):
+        return name in self._manifest
+
+    def __iter__(self):
+        """List object ids"""
+        return iter(self._manifest)
+
+    def __len__(self):
+        return len(self._manifest)